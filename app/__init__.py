@@ -12,9 +12,10 @@ from flask_moment import Moment
 # Remove the import line 'from app import db'
 
 from config import Config
+from app.database import RoutingSession
 
 # db object is created here and is accessible within this file.
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 htmx = HTMX()
 moment = Moment()
@@ -28,16 +29,35 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
 
     ##Extensions
+    from app import database
+    from app import metrics
+    database.configure(app)
+    metrics.configure(app)
     db.init_app(app)
+    from app import instrument
+    instrument.init_app(app)
+    metrics.init_app(app)
     migrate.init_app(app, db)
     htmx.init_app(app)
     login.init_app(app)
     moment.init_app(app)
 
-    from app.models import User
-    @login.user_loader
-    def load_user(id):
-        return db.session.get(User, int(id))
+    from app import cache
+    cache.init_app(app)
+    from app.widgets.registry import registry
+    registry.init_app(app)
+
+    from app.identity import identities
+    identities.init_app(app)
+    from app import activity
+    activity.init_app(app)
+
+    from app.pagecache import pagecache
+    pagecache.init_app(app)
+    from app.assets import assets
+    assets.init_app(app)
+    from app.templatecache import template_cache
+    template_cache.init_app(app)
 
     ##Blueprints
     from app.main import bp as main_bp
@@ -46,6 +66,11 @@ def create_app(config_class=Config):
     from app.widgets import bp as widget_bp
     app.register_blueprint(widget_bp, url_prefix='/widgets')
 
+    from app.feeds import bp as feeds_bp
+    from app.feeds.routes import feeds
+    app.register_blueprint(feeds_bp)
+    feeds.init_app(app)
+
     from app.cli import bp as cli_bp
     app.register_blueprint(cli_bp)
     from app.auth.routes import bp as login_bp
@@ -71,6 +96,8 @@ def create_app(config_class=Config):
         app.logger.setLevel(logging.INFO)
         app.logger.info('CMS startup')
 
+    database.init_app(app)
+
     return app
 
 #from app import models
@@ -0,0 +1,124 @@
+import atexit
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+import sqlalchemy as sa
+from flask import current_app, request
+from flask_login import current_user
+
+from app import db
+from app.models import User
+
+
+class ActivityTracker:
+    """Write-behind buffer for an activity timestamp column such as
+    `User.last_seen`.
+
+    Requests only record `id -> time` in memory. The buffer is written with
+    one executemany UPDATE every `ACTIVITY_FLUSH_INTERVAL` seconds, as soon as
+    `ACTIVITY_BATCH_SIZE` rows are waiting, and when the worker exits.
+
+    The timed writes come from a daemon thread, started by the first `seen`
+    of each worker process, so they happen whether or not requests follow.
+    """
+
+    def __init__(self, column : sa.Column):
+        self.column = column
+        self.interval = 60.0
+        self.batch_size = 500
+        self._pending = {}
+        self._flushed = time.monotonic()
+        self._app = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.interval = app.config['ACTIVITY_FLUSH_INTERVAL']
+        self.batch_size = app.config['ACTIVITY_BATCH_SIZE']
+        # a running thread waits on the old interval otherwise
+        self._wake.set()
+        # one exit hook per tracker, flushing through the latest app
+        if self._app is None:
+            atexit.register(self._shutdown)
+        self._app = app
+
+    @property
+    def pending(self) -> int:
+        """Rows waiting to be written."""
+        return len(self._pending)
+
+    def seen(self, row_id : int, when : Optional[datetime] = None):
+        when = when or datetime.now(timezone.utc)
+        with self._lock:
+            self._pending[row_id] = when
+            # threads do not survive a fork, so each worker starts its own
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='activity-flush', daemon=True)
+                self._thread.start()
+
+    def due(self) -> bool:
+        if not self._pending:
+            return False
+        return len(self._pending) >= self.batch_size or \
+            time.monotonic() - self._flushed >= self.interval
+
+    def flush(self) -> int:
+        """Write the buffer out. Returns the number of rows sent."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._flushed = time.monotonic()
+            if not pending:
+                return 0
+
+            table = self.column.table
+            stmt = sa.update(table) \
+                .where(table.c.id == sa.bindparam('row_id'),
+                       sa.or_(self.column.is_(None), self.column < sa.bindparam('seen'))) \
+                .values({ self.column.key: sa.bindparam('seen') })
+            rows = [{ 'row_id': row_id, 'seen': when } for row_id, when in pending.items()]
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(stmt, rows)
+            except sa.exc.SQLAlchemyError as e:
+                current_app.logger.warning('Could not write %s: %s', self.column, e)
+                with self._lock:
+                    for row_id, when in pending.items():
+                        self._pending.setdefault(row_id, when)
+                return 0
+            return len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(max(self.interval - (time.monotonic() - self._flushed), 0.1))
+            self._wake.clear()
+            if self.due():
+                with self._app.app_context():
+                    self.flush()
+
+    def _shutdown(self):
+        if self._pending:
+            with self._app.app_context():
+                self.flush()
+
+
+last_seen = ActivityTracker(User.__table__.c.last_seen)
+
+
+def init_app(app):
+    last_seen.init_app(app)
+
+    @app.after_request
+    def _track_user(response):
+        # asking for the user reads the session, which adds `Vary: Cookie`
+        if request.endpoint == 'static':
+            return response
+        if current_user.is_authenticated:
+            last_seen.seen(current_user.id)
+            if last_seen.due():
+                last_seen.flush()
+        return response
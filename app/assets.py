@@ -0,0 +1,156 @@
+import os
+import time
+import gzip
+import json
+import hashlib
+import mimetypes
+import tempfile
+from typing import Optional
+
+from flask import request, send_from_directory
+
+MANIFEST = 'manifest.json'
+# worth compressing ahead of time; images and fonts already are
+COMPRESSIBLE = ('.css', '.js', '.map', '.json', '.svg', '.txt', '.xml', '.html')
+
+
+def _write(path : str, data : bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def fingerprint(filename : str, data : bytes) -> str:
+    """'css/style.css' -> 'css/style.<hash>.css'"""
+    root, ext = os.path.splitext(filename)
+    return '{}.{}{}'.format(root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def build(static_dir : str, out_dir : str) -> tuple[dict[str, str], int]:
+    """Copy every static file to `out_dir` under a content-hashed name, with a
+    `.gz` next to it when that is smaller, and write the manifest.
+
+    Returns the manifest and how many files were compressed. Files from
+    earlier builds are left alone so pages rendered before a deploy keep
+    working.
+    """
+    manifest = {}
+    compressed = 0
+    for root, dirs, files in os.walk(static_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            with open(path, 'rb') as file:
+                data = file.read()
+
+            hashed = fingerprint(filename, data)
+            manifest[filename] = hashed
+            target = os.path.join(out_dir, hashed)
+            if not os.path.exists(target):
+                _write(target, data)
+
+            if name.lower().endswith(COMPRESSIBLE):
+                packed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(packed) < len(data):
+                    compressed += 1
+                    if not os.path.exists(target + '.gz'):
+                        _write(target + '.gz', packed)
+
+    _write(os.path.join(out_dir, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest, compressed
+
+
+class Assets:
+    """Serves `static` through the manifest written by `flask assets build`.
+
+    `url_for('static', filename=...)` returns the fingerprinted name, which is
+    sent from `ASSETS_DIR`, gzipped ahead of time when the client accepts it,
+    and cached for good. Files missing from the manifest, or every file when
+    there is no build, are served by Flask as usual.
+
+    A build while the app runs is picked up by its manifest's mtime, checked
+    at most every `CACHE_CHECK_INTERVAL` seconds.
+    """
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.max_age = 0
+        self.check_interval = 0.0
+        self.manifest = {}
+        self.built = set()
+        self._mtime = None
+        self._checked = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config['ASSETS_DIR']
+        self.max_age = app.config['ASSETS_MAX_AGE']
+        self.check_interval = app.config['CACHE_CHECK_INTERVAL']
+        self.load()
+
+        app.before_request(self._reload)
+        app.url_defaults(self._fingerprint)
+        static = app.view_functions.get('static')
+        if static is not None:
+            app.view_functions['static'] = lambda filename: self.send(filename) \
+                if filename in self.built else static(filename=filename)
+
+    def load(self, manifest : Optional[dict[str, str]] = None):
+        self._mtime = self._stat()
+        self._checked = time.monotonic()
+        if manifest is None:
+            try:
+                with open(os.path.join(self.directory, MANIFEST)) as file:
+                    manifest = json.load(file)
+            except (OSError, ValueError):
+                manifest = {}
+        self.built = set(manifest.values())
+        self.manifest = manifest
+
+    def _stat(self) -> Optional[int]:
+        try:
+            return os.stat(os.path.join(self.directory, MANIFEST)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        if self._stat() != self._mtime:
+            self.load()
+
+    def _fingerprint(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def send(self, filename : str):
+        name = filename
+        gzipped = 'gzip' in request.accept_encodings and \
+            os.path.isfile(os.path.join(self.directory, filename + '.gz'))
+        if gzipped:
+            name += '.gz'
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(self.directory, name, mimetype=mimetype,
+                                       max_age=self.max_age)
+        if gzipped:
+            response.content_encoding = 'gzip'
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+assets = Assets()
@@ -0,0 +1,152 @@
+import os
+import time
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import event
+import sqlalchemy.orm as so
+
+
+class VersionStamp:
+    """A change marker shared by every worker on the node.
+
+    The token is the mtime of a file under `CACHE_DIR`. Bumping it touches the
+    file; reading it costs one `stat` at most every `CACHE_CHECK_INTERVAL`
+    seconds, so other workers notice a change within that bound.
+    """
+    _all : list['VersionStamp'] = []
+
+    def __init__(self, name : str, path : Optional[str] = None, check_interval : float = 0.0):
+        self.name = name
+        self.path = path
+        self.check_interval = check_interval
+        self._token = 0
+        self._checked = 0.0
+        # stamps given their file are made by a StampFamily after init_app
+        if path is None:
+            VersionStamp._all.append(self)
+
+    def __repr__(self):
+        return '<VersionStamp {}>'.format(self.name)
+
+    def init_app(self, app):
+        cache_dir = app.config['CACHE_DIR']
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, '{}.stamp'.format(self.name))
+        self.check_interval = app.config['CACHE_CHECK_INTERVAL']
+        self._checked = 0.0
+
+    @property
+    def token(self) -> int:
+        now = time.monotonic()
+        if self.path is not None and now - self._checked >= self.check_interval:
+            self._checked = now
+            try:
+                self._token = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                pass
+        return self._token
+
+    def bump(self):
+        token = max(time.time_ns(), self._token + 1)
+        if self.path is not None:
+            with open(self.path, 'a'):
+                pass
+            os.utime(self.path, ns=(token, token))
+            token = os.stat(self.path).st_mtime_ns
+        self._token = token
+        self._checked = time.monotonic()
+
+
+widgets_version = VersionStamp('widgets')
+categories_version = VersionStamp('categories')
+tags_version = VersionStamp('tags')
+posts_version = VersionStamp('posts')
+users_version = VersionStamp('users')
+# rendered cards, for rewrites that leave last_modified alone
+cards_version = VersionStamp('cards')
+# the full-text table, recreated by `flask search rebuild`
+search_version = VersionStamp('search')
+
+
+class StampFamily:
+    """VersionStamps made on demand from names only known at runtime, such
+    as one per post slug.
+
+    Their files are under `CACHE_DIR/<name>`, named by a hash of the stamp
+    name. The `max_stamps` last used are kept; the others are read again
+    from their file when next asked for.
+    """
+
+    def __init__(self, name : str, max_stamps : int = 4096):
+        self.name = name
+        self.max_stamps = max_stamps
+        self.directory = None
+        self.check_interval = 0.0
+        self._stamps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = os.path.join(app.config['CACHE_DIR'], self.name)
+        os.makedirs(self.directory, exist_ok=True)
+        self.check_interval = app.config['CACHE_CHECK_INTERVAL']
+        with self._lock:
+            self._stamps.clear()
+
+    def __getitem__(self, name : str) -> VersionStamp:
+        with self._lock:
+            stamp = self._stamps.get(name)
+            if stamp is not None:
+                self._stamps.move_to_end(name)
+                return stamp
+            if self.directory is None:
+                raise RuntimeError('{!r} is used before init_app'.format(self.name))
+            path = os.path.join(self.directory, hashlib.sha1(name.encode()).hexdigest())
+            stamp = self._stamps[name] = VersionStamp(name, path, self.check_interval)
+            while len(self._stamps) > self.max_stamps:
+                self._stamps.popitem(last=False)
+            return stamp
+
+
+# cached pages, one per dependency name (see app.pagecache)
+page_stamps = StampFamily('deps')
+
+
+def init_app(app):
+    for stamp in VersionStamp._all:
+        stamp.init_app(app)
+    page_stamps.init_app(app)
+
+
+## Change tracking
+
+def watch(stamp : VersionStamp, *models):
+    """Bump `stamp` once the session that changed any of `models` commits."""
+    for model in models:
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, name, functools.partial(_mark_changed, stamp))
+
+
+def mark_changed(session, *stamps : VersionStamp):
+    """Bump `stamps` when `session` commits, for changes made outside the ORM."""
+    session.info.setdefault('cms_changed', set()).update(stamps)
+
+
+def _mark_changed(stamp, mapper, connection, target):
+    session = so.object_session(target)
+    if session is not None:
+        mark_changed(session, stamp)
+
+
+@event.listens_for(so.Session, 'after_commit')
+def _bump_changed(session):
+    for stamp in session.info.pop('cms_changed', ()):
+        stamp.bump()
+
+
+@event.listens_for(so.Session, 'after_rollback')
+def _discard_changed(session):
+    session.info.pop('cms_changed', None)
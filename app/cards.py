@@ -0,0 +1,217 @@
+import math
+from datetime import datetime, timezone
+from html import escape
+from typing import Iterable
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy import event
+from flask import current_app
+
+from app.cache import mark_changed, cards_version
+from app.models import Post, User, Category, Tag, post_tags, post_tags_changed
+from app.search import html_to_text
+
+# Listing cards are drawn from `post` columns alone: the resume, excerpt,
+# word count and reading time derived from the body, and copies of the
+# author, category and tag names. Each is rewritten when what it is copied
+# from changes, so a page of cards is one query.
+
+CARD_COLUMNS = (
+    Post.id, Post.slug, Post.title, Post.resume, Post.word_count, Post.reading_time,
+    Post.timestamp, Post.last_modified, Post.comment_count,
+    Post.user_id, Post.author_username, Post.author_name,
+    Post.category_id, Post.category_name, Post.tag_names,
+)
+
+
+def summarize(body : str, length : int, words_per_minute : int) -> dict:
+    """The body-derived card columns.
+
+    The excerpt is the first `length` words of the text. The resume is the
+    first paragraph, or the excerpt as a paragraph when that one is longer.
+    """
+    words = html_to_text(body).split()
+    excerpt = ' '.join(words[:length]) + ('…' if len(words) > length else '')
+
+    end = (body or '').find('</p>')
+    resume = body[:end + 4] if end != -1 else ''
+    if not resume or len(html_to_text(resume).split()) > length:
+        resume = '<p>{}</p>'.format(escape(excerpt)) if excerpt else ''
+
+    return { 'resume': resume, 'excerpt': excerpt, 'word_count': len(words),
+             'reading_time': max(1, math.ceil(len(words) / words_per_minute)) }
+
+
+def _summarize(body : str) -> dict:
+    config = current_app.config
+    return summarize(body, config['RESUME_LENGTH'], config['WORDS_PER_MINUTE'])
+
+
+## Copies of names
+
+def _loaded(target, key : str, *attributes):
+    """`target.key` when it and its `attributes` are in memory, else None.
+    Never loads anything, so it is safe inside a flush."""
+    value = sa.inspect(target).dict.get(key)
+    if value is None or not set(attributes) <= sa.inspect(value).dict.keys():
+        return None
+    return value
+
+def _author(connection, target : Post) -> dict:
+    # the importer and the forms set `author`, so this is usually free
+    user = _loaded(target, 'author', 'id', 'username', 'fullname')
+    if user is None or user.id != target.user_id:
+        table = User.__table__
+        user = connection.execute(
+            sa.select(table.c.username, table.c.fullname).where(table.c.id == target.user_id)
+        ).first()
+    return { 'author_username': user.username if user else None,
+             'author_name': user.fullname if user else None }
+
+def _category(connection, target : Post) -> dict:
+    category = _loaded(target, 'category', 'id', 'category')
+    if category is not None and category.id == target.category_id:
+        return { 'category_name': category.category }
+    table = Category.__table__
+    return { 'category_name': connection.scalar(
+        sa.select(table.c.category).where(table.c.id == target.category_id)) }
+
+def refresh_tags(connection, post_ids : Iterable[int]):
+    """Rewrite `tag_names` of `post_ids` from post_tags, with one SELECT and
+    one executemany UPDATE."""
+    names = { post_id: set() for post_id in post_ids }
+    if not names:
+        return
+    tag = Tag.__table__
+    for post_id, name in connection.execute(
+            sa.select(post_tags.c.post_id, tag.c.tag)
+            .join(tag, tag.c.id == post_tags.c.tag_id)
+            .where(post_tags.c.post_id.in_(names))):
+        names[post_id].add(name)
+
+    post = Post.__table__
+    connection.execute(
+        sa.update(post).where(post.c.id == sa.bindparam('post_id'))
+        .values(tag_names=sa.bindparam('names')),
+        [{ 'post_id': post_id, 'names': sorted(tags) } for post_id, tags in names.items()]
+    )
+
+
+def rebuild(connection, chunk : int = 500) -> int:
+    """Recompute every card from the post, user, category and tag tables.
+    Returns the number of posts."""
+    post, user, category = Post.__table__, User.__table__, Category.__table__
+    connection.execute(sa.update(post).values(
+        author_username=sa.select(user.c.username).where(user.c.id == post.c.user_id).scalar_subquery(),
+        author_name=sa.select(user.c.fullname).where(user.c.id == post.c.user_id).scalar_subquery(),
+        category_name=sa.select(category.c.category)
+            .where(category.c.id == post.c.category_id).scalar_subquery(),
+    ))
+
+    update = sa.update(post).where(post.c.id == sa.bindparam('post_id')).values(
+        resume=sa.bindparam('resume'), excerpt=sa.bindparam('excerpt'),
+        word_count=sa.bindparam('word_count'), reading_time=sa.bindparam('reading_time'))
+    count = last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(post.c.id, post.c.body).where(post.c.id > last_id)
+            .order_by(post.c.id).limit(chunk)
+        ).all()
+        if not rows:
+            return count
+        connection.execute(update, [dict(_summarize(body), post_id=post_id) for post_id, body in rows])
+        refresh_tags(connection, [post_id for post_id, _ in rows])
+        count += len(rows)
+        last_id = rows[-1].id
+
+
+## Events
+
+def _changed(target, *keys) -> bool:
+    state = sa.inspect(target)
+    return any(state.attrs[key].history.has_changes() for key in keys)
+
+@event.listens_for(Post, 'before_insert')
+def _fill_card(mapper, connection, target):
+    for key, value in _summarize(target.body).items():
+        setattr(target, key, value)
+    for key, value in (_author(connection, target) | _category(connection, target)).items():
+        setattr(target, key, value)
+    if target.tag_names is None:
+        target.tag_names = []
+
+@event.listens_for(Post, 'before_update')
+def _update_card(mapper, connection, target):
+    # cached cards and page validators are keyed on last_modified
+    if _changed(target, 'title', 'slug', 'body') and not _changed(target, 'last_modified'):
+        target.last_modified = datetime.now(timezone.utc)
+    if _changed(target, 'body'):
+        for key, value in _summarize(target.body).items():
+            setattr(target, key, value)
+    if _changed(target, 'user_id', 'author'):
+        for key, value in _author(connection, target).items():
+            setattr(target, key, value)
+    if _changed(target, 'category_id', 'category'):
+        for key, value in _category(connection, target).items():
+            setattr(target, key, value)
+
+@event.listens_for(User, 'after_update')
+def _author_renamed(mapper, connection, target):
+    if _changed(target, 'username', 'fullname'):
+        post = Post.__table__
+        connection.execute(sa.update(post).where(post.c.user_id == target.id)
+                           .values(author_username=target.username, author_name=target.fullname))
+        mark_changed(so.object_session(target), cards_version)
+
+@event.listens_for(Category, 'after_update')
+def _category_renamed(mapper, connection, target):
+    if _changed(target, 'category'):
+        post = Post.__table__
+        connection.execute(sa.update(post).where(post.c.category_id == target.id)
+                           .values(category_name=target.category))
+        mark_changed(so.object_session(target), cards_version)
+
+
+# tag_names: posts whose tags moved and tags renamed are noted
+# during the flush and rewritten once it is done
+
+def _pending(session) -> dict:
+    return session.info.setdefault('cms_card_tags', { 'posts': set(), 'tag_ids': set() })
+
+@event.listens_for(Post.tags, 'append')
+@event.listens_for(Post.tags, 'remove')
+def _post_tags_moved(target, value, initiator):
+    session = so.object_session(target) or so.object_session(value)
+    if session is not None:
+        _pending(session)['posts'].add(target)
+
+@event.listens_for(Tag, 'after_update')
+def _tag_renamed(mapper, connection, target):
+    session = so.object_session(target)
+    if session is not None and _changed(target, 'tag'):
+        _pending(session)['tag_ids'].add(target.id)
+
+@post_tags_changed.connect
+def _post_tags_set(post, session, tag_ids):
+    refresh_tags(session.connection(), [post.id])
+    session.expire(post, ['tag_names'])
+
+@event.listens_for(so.Session, 'after_flush_postexec')
+def _refresh_tags(session, flush_context):
+    pending = session.info.pop('cms_card_tags', None)
+    if not pending:
+        return
+    post_ids = { post.id for post in pending['posts'] if post.id is not None }
+    if pending['tag_ids']:
+        post_ids.update(session.connection().scalars(
+            sa.select(post_tags.c.post_id).where(post_tags.c.tag_id.in_(pending['tag_ids']))))
+    refresh_tags(session.connection(), post_ids)
+    for post_id in post_ids:
+        post = session.identity_map.get(session.identity_key(Post, post_id))
+        if post is not None:
+            session.expire(post, ['tag_names'])
+
+@event.listens_for(so.Session, 'after_rollback')
+def _discard_tags(session):
+    session.info.pop('cms_card_tags', None)
@@ -1,76 +1,80 @@
-import os
-from flask import Blueprint
+from flask import Blueprint, current_app
 import click
 from click import ClickException
-from markdown import Markdown
-import re
-from slugify import slugify
 import sqlalchemy as sa
 from datetime import datetime, timezone
+from typing import Optional
 
 from app import db
-from app.models import Post, User, Category, Tag
+from app.models import Post, User, Category, Comment, recount_tags, recount_comments
+from app.cache import tags_version, posts_version, cards_version, search_version
+from app import importer, search, cards
+from app.pagecache import pagecache
+from app.importer import Source, SourceError
 
 bp = Blueprint('cli', __name__, cli_group=None)
-md = Markdown(extensions=['meta'])
 
 ## Utilities
 
-def _process_file(path : str):
-    if not os.path.isfile(path):
-        raise ClickException('File not found')
-    
-    regexp = r'\.(md|txt)$'
+def _process_file(path : str, known : Optional[dict[str, Source]] = None, force=False) -> str:
+    """Create or update the post stored in `path`.
 
-    if re.search(regexp, path, re.IGNORECASE) is None:
-        raise ClickException('Invalid file extension. Valid extensions: .md, .txt')
-    
-    filename = os.path.split(path)[1]
-    slug = slugify(os.path.splitext(filename)[0])
-    
-    with open(path, 'r') as file:
-        md_content = file.read()
+    Returns 'created', 'updated' or 'skipped'. A file is skipped without
+    being read when its path and mtime match what was stored for the post,
+    and without being converted when its content hash matches.
+    """
+    try:
+        source = importer.locate(path)
+    except SourceError as e:
+        raise ClickException(str(e))
 
-    html = md.convert(md_content)
+    if known is None:
+        known = importer.known_sources()
+    stored = known.get(source.slug)
+    if not force and importer.is_unchanged(source, stored):
+        return 'skipped'
 
-    if not 'title' in md.Meta.keys():
-        raise ClickException('Title not found')
-    
-    if not 'author' in md.Meta.keys():
-        raise ClickException('Author not found')
-    
-    if not 'category' in md.Meta.keys():
-        raise ClickException('Category not found')
+    try:
+        importer.parse(source, stored.content_hash if stored and not force else None)
+    except (SourceError, OSError, UnicodeDecodeError) as e:
+        raise ClickException(str(e))
+
+    if source.unchanged:
+        importer.touch_sources([source], known)
+        db.session.commit()
+        return 'skipped'
 
-    category = Category.find_category(md.Meta['category'][0], create_if_not_exists=True)
+    category = Category.find_category(source.category, create_if_not_exists=True)
 
     author = db.session.scalar(
-        sa.select(User).where(User.username == md.Meta['author'][0])
+        sa.select(User).where(User.username == source.author)
     )
 
     if author is None:
         raise ClickException('Author doesn\'t exist in database')
     
-    taglist = []
-    if 'tags' in md.Meta.keys():
-        for tag in md.Meta['tags']:
-            taglist.append(Tag.find_tag(tag, create_if_not_exists=True))
-
-    post = Post.get_by_slug(slug)
+    post = Post.get_by_slug(source.slug)
     if post is None:
-        post = Post(slug=slug, author=author, category=category, title=md.Meta['title'][0], body=html)
+        result = 'created'
+        post = Post(slug=source.slug, author=author, category=category, title=source.title, body=source.html)
         db.session.add(post)
     else:
+        result = 'updated'
         post.last_modified = datetime.now(timezone.utc)
         post.author = author
-        post.body = html
+        post.body = source.html
         post.category = category
-        post.title = md.Meta['title'][0]
+        post.title = source.title
+
+    post.source_path = source.source_path
+    post.source_mtime = source.source_mtime
+    post.content_hash = source.content_hash
     
-    if len(taglist) > 0:
-        post.add_tags(taglist)
+    if len(source.tags) > 0:
+        post.merge_tags(source.tags)
 
     db.session.commit()
+    return result
 
 
 ## Cli groups
@@ -85,21 +89,108 @@ def user():
     """User management"""
     pass
 
+@bp.cli.group()
+def cache():
+    """Response cache"""
+    pass
+
+@bp.cli.group('search')
+def search_group():
+    """Full-text search index"""
+    pass
+
+@bp.cli.group()
+def counters():
+    """Denormalized counters"""
+    pass
+
+@bp.cli.group('cards')
+def cards_group():
+    """Post listing cards"""
+    pass
+
+@bp.cli.group()
+def assets():
+    """Static asset pipeline"""
+    pass
+
+@bp.cli.group()
+def site():
+    """Static site export"""
+    pass
+
+@bp.cli.group()
+def comments():
+    """Comment moderation"""
+    pass
+
 ## File commands
 
 @file.command()
 @click.argument('files', nargs=-1)
-def upload(files : tuple[str, ...]):
+@click.option('-f', '--force', is_flag=True, help='Reprocess files even if unchanged')
+def upload(files : tuple[str, ...], force):
     """Upload a list of files to CMS"""
+    counts = { 'created': 0, 'updated': 0, 'skipped': 0, 'failed': 0 }
+    known = importer.known_sources()
     with click.progressbar(files, label='Processing files') as bar:
         for file in bar:
             try:
-                _process_file(file)
+                counts[_process_file(file, known, force=force)] += 1
             except ClickException as e:
                 e.show()
                 db.session.rollback()
+                counts['failed'] += 1
     
-    click.echo('Upload complete!')
+    click.echo('Upload complete! {created} created, {updated} updated, '
+               '{skipped} skipped, {failed} failed'.format(**counts))
+
+@file.command('import')
+@click.argument('files', nargs=-1)
+@click.option('-j', '--jobs', type=int, help='Parser processes (default: one per CPU)')
+@click.option('-b', '--batch-size', type=int, help='Files written per transaction')
+@click.option('-f', '--force', is_flag=True, help='Reprocess files even if unchanged')
+def bulk_import(files : tuple[str, ...], jobs, batch_size, force):
+    """Import many files in parallel, in batched transactions"""
+    report = importer.import_files(
+        files, batch_size or current_app.config['IMPORT_BATCH_SIZE'],
+        jobs=jobs or current_app.config['IMPORT_JOBS'], force=force
+    )
+
+    for path, error in report.errors:
+        click.echo('{}: {}'.format(path, error), err=True)
+    click.echo('Import complete! {} created, {} updated, {} skipped, {} failed'.format(
+        report.created, report.updated, report.skipped, len(report.errors)))
+
+## Search commands
+
+@search_group.command('rebuild')
+def search_rebuild():
+    """Rebuild the full-text index from all posts"""
+    count = search.rebuild(db.session.connection())
+    db.session.commit()
+    search_version.bump()
+    # search results are cached with the `posts` listings
+    pagecache.invalidate(('posts',))
+
+    click.echo('Indexed {} posts!'.format(count))
+
+## Card commands
+
+@cards_group.command('rebuild')
+def cards_rebuild():
+    """Recompute every post's card: excerpt, reading time and names"""
+    count = cards.rebuild(db.session.connection())
+    # the resume is indexed too
+    search.rebuild(db.session.connection())
+    db.session.commit()
+    posts_version.bump()
+    cards_version.bump()
+    search_version.bump()
+    # every cached page shows cards
+    pagecache.invalidate(('all',))
+
+    click.echo('Rebuilt {} cards!'.format(count))
 
 ## User commands
 
@@ -123,4 +214,125 @@ def create(username, email, fullname, admin, edit, mod):
 @click.argument('username')
 def delete(username):
     """Delete user"""
-    pass
\ No newline at end of file
+    pass
+
+## Cache commands
+
+@cache.command()
+def clear():
+    """Drop every cached page"""
+    pagecache.clear()
+
+    click.echo('Cache cleared!')
+
+## Asset commands
+
+@assets.command('build')
+def assets_build():
+    """Fingerprint and precompress the static files"""
+    from app.assets import assets as pipeline, build
+    manifest, compressed = build(current_app.static_folder, current_app.config['ASSETS_DIR'])
+    pipeline.load(manifest)
+
+    click.echo('Assets built! {} files, {} compressed'.format(len(manifest), compressed))
+
+## Site commands
+
+@site.command('build')
+@click.argument('outdir', type=click.Path(file_okay=False))
+@click.option('-j', '--jobs', type=int, help='Render processes (default: one per CPU)')
+@click.option('-f', '--force', is_flag=True, help='Render every page, changed or not')
+def site_build(outdir, jobs, force):
+    """Render the site to static files, only pages that changed"""
+    from app import export
+    report = export.build(outdir, jobs=jobs, force=force)
+    for page, error in report.errors:
+        click.echo('{}: {}'.format(page, error), err=True)
+
+    click.echo('Site built! {} rendered, {} unchanged, {} removed, {} failed'.format(
+        report.rendered, report.unchanged, report.removed, len(report.errors)))
+
+## Counter commands
+
+@counters.command()
+def rebuild():
+    """Recount tag post counts and post comment counts"""
+    connection = db.session.connection()
+    recount_tags(connection)
+    recount_comments(connection)
+    db.session.commit()
+    tags_version.bump()
+    posts_version.bump()
+    # counts show on every card and in the tag sidebar
+    pagecache.invalidate(('all',))
+
+    click.echo('Counters rebuilt!')
+
+## Comment commands
+
+def _pending_comments(ids, slug, everything):
+    query = sa.select(Comment.id).where(Comment.pending())
+    if ids:
+        query = query.where(Comment.id.in_(ids))
+    elif slug:
+        query = query.join(Post, Post.id == Comment.post_id).where(Post.slug == slug)
+    elif not everything:
+        raise ClickException('Pass comment ids, --post or --all')
+    return query.order_by(Comment.id)
+
+def _moderate(ids, slug, everything, approve, moderator, batch_size):
+    query = _pending_comments(ids, slug, everything)
+    total = 0
+    last_id = 0
+    while True:
+        batch = db.session.scalars(
+            query.where(Comment.id > last_id).limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        total += Comment.moderate(batch, approve, moderator)
+        db.session.commit()
+        last_id = batch[-1]
+    return total
+
+@comments.command()
+@click.option('-p', '--post', 'slug', help='Only comments on this post')
+@click.option('-n', '--limit', default=50, show_default=True)
+def pending(slug, limit):
+    """List comments waiting for moderation, oldest first"""
+    query = sa.select(Comment.id, Post.slug, User.username, Comment.timestamp, Comment.body) \
+        .join(Post, Post.id == Comment.post_id).join(User, User.id == Comment.user_id) \
+        .where(Comment.pending())
+    if slug:
+        query = query.where(Post.slug == slug)
+    rows = db.session.execute(
+        query.order_by(Comment.timestamp, Comment.id).limit(limit)
+    )
+    for comment_id, post_slug, username, timestamp, body in rows:
+        click.echo('{:>6}  {}  {}  {}: {}'.format(
+            comment_id, timestamp.strftime('%Y-%m-%d %H:%M'), post_slug, username,
+            body.replace('\n', ' ')[:60]))
+
+@comments.command()
+@click.argument('ids', nargs=-1, type=int)
+@click.option('-p', '--post', 'slug', help='Every pending comment on this post')
+@click.option('-a', '--all', 'everything', is_flag=True, help='Every pending comment')
+@click.option('--by', 'moderator', default='cli', show_default=True, help='Moderator name')
+@click.option('-b', '--batch-size', default=1000, show_default=True,
+              help='Comments changed per transaction')
+def approve(ids, slug, everything, moderator, batch_size):
+    """Approve pending comments"""
+    count = _moderate(ids, slug, everything, True, moderator, batch_size)
+    click.echo('{} comments approved'.format(count))
+
+@comments.command()
+@click.argument('ids', nargs=-1, type=int)
+@click.option('-p', '--post', 'slug', help='Every pending comment on this post')
+@click.option('-a', '--all', 'everything', is_flag=True, help='Every pending comment')
+@click.option('--by', 'moderator', default='cli', show_default=True, help='Moderator name')
+@click.option('-b', '--batch-size', default=1000, show_default=True,
+              help='Comments changed per transaction')
+def block(ids, slug, everything, moderator, batch_size):
+    """Block pending comments"""
+    count = _moderate(ids, slug, everything, False, moderator, batch_size)
+    click.echo('{} comments blocked'.format(count))
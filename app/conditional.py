@@ -0,0 +1,74 @@
+import hashlib
+from datetime import datetime, timezone
+from typing import Optional
+
+from flask import request, g, current_app
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+from app import htmx
+from app.cache import widgets_version, categories_version, tags_version, posts_version, users_version
+
+# cards also show comment counts, tags, categories and authors, which change
+# without the post's last_modified
+content_stamps = (posts_version, tags_version, categories_version, users_version)
+# the sidebar drawn around full pages changes with these too
+layout_stamps = (widgets_version,)
+
+
+def _utc(value : datetime) -> datetime:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+
+def validators(posts) -> tuple[str, Optional[datetime]]:
+    """ETag and Last-Modified for a page showing `posts`.
+
+    Only columns already loaded for the page are read, never `body`.
+    """
+    parts = [current_user.get_id(), bool(htmx)]
+    newest = None
+    for post in posts:
+        parts.append((post.id, post.last_modified.isoformat(), post.comment_count))
+        modified = _utc(post.last_modified)
+        newest = modified if newest is None else max(newest, modified)
+
+    for stamp in content_stamps + (() if htmx else layout_stamps):
+        token = stamp.token
+        parts.append(token)
+        if token:
+            modified = _utc(datetime.fromtimestamp(token / 1e9, timezone.utc))
+            newest = modified if newest is None else max(newest, modified)
+
+    return hashlib.sha1(repr(parts).encode()).hexdigest(), newest
+
+
+def conditional(posts):
+    """Return a 304 response if the client's copy of the page is current.
+
+    Otherwise remember the validators so `add_validators` can send them with
+    the rendered page.
+    """
+    etag, last_modified = validators(posts)
+    g.validators = (etag, last_modified)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return current_app.response_class(status=304)
+    return None
+
+
+def add_validators(response):
+    cached = g.pop('validators', None)
+    if cached is None or response.status_code not in (200, 304):
+        return response
+
+    etag, last_modified = cached
+    # a gzipped body is another representation of the same page
+    response.set_etag(etag, weak=response.content_encoding == 'gzip')
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+    response.vary.update(('HX-Request', 'Cookie'))
+    return response
@@ -0,0 +1,172 @@
+import functools
+import itertools
+from urllib.parse import quote
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+# config key -> pragma, applied to every new SQLite connection; an empty
+# value leaves the SQLite default alone
+PRAGMAS = (
+    ('SQLITE_JOURNAL_MODE', 'journal_mode'),
+    ('SQLITE_SYNCHRONOUS', 'synchronous'),
+    ('SQLITE_BUSY_TIMEOUT', 'busy_timeout'),
+    ('SQLITE_CACHE_SIZE', 'cache_size'),
+    ('SQLITE_MMAP_SIZE', 'mmap_size'),
+    ('SQLITE_TEMP_STORE', 'temp_store'),
+)
+
+# what SQLite reports back for the symbolic values
+_SYNCHRONOUS = { 'off': '0', 'normal': '1', 'full': '2', 'extra': '3' }
+_TEMP_STORE = { 'default': '0', 'file': '1', 'memory': '2' }
+
+
+def _is_memory(url : sa.engine.URL) -> bool:
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def read_only_uri(url : sa.engine.URL) -> str:
+    """The same SQLite file, opened with `mode=ro`."""
+    # SQLite reads the path as a URI: `?`, `#`, `%` and spaces must be escaped
+    return 'sqlite:///file:{}?mode=ro&uri=true'.format(quote(url.database))
+
+
+def configure(app):
+    """Fill in the engine options and read binds. Must run before `db.init_app`."""
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    url = sa.engine.make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    read_uris = list(app.config['SQLALCHEMY_READ_URIS'])
+    if not read_uris and app.config['SQLITE_READ_ONLY_BIND'] \
+            and url.get_backend_name() == 'sqlite' and not _is_memory(url):
+        read_uris = [read_only_uri(url)]
+    # one pool per engine and worker process; size it for the worker's threads
+    pool = { 'pool_size': app.config['DB_POOL_SIZE'], 'max_overflow': app.config['DB_MAX_OVERFLOW'],
+             'pool_timeout': app.config['DB_POOL_TIMEOUT'] }
+    if app.config['DB_POOL_RECYCLE']:
+        pool['pool_recycle'] = app.config['DB_POOL_RECYCLE']
+    if not _is_memory(url):
+        for name, value in pool.items():
+            options.setdefault(name, value)
+
+    # SQLALCHEMY_ENGINE_OPTIONS only reach the primary: binds get their own
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    app.config['READ_BINDS'] = []
+    for index, uri in enumerate(read_uris):
+        key = 'read{}'.format(index)
+        binds[key] = { 'url': uri }
+        if not _is_memory(sa.engine.make_url(uri)):
+            binds[key].update(pool)
+        app.config['READ_BINDS'].append(key)
+
+
+def is_read_bind(app, engine) -> bool:
+    engines = app.extensions['sqlalchemy'].engines
+    return any(engines.get(key) is engine for key in app.config['READ_BINDS'])
+
+
+def pragmas(app) -> dict[str, str]:
+    return { pragma: str(app.config[key]).lower() for key, pragma in PRAGMAS
+             if app.config.get(key) not in (None, '') }
+
+
+def init_app(app):
+    """Apply the SQLite profile to every engine of the app and check it took."""
+    with app.app_context():
+        engines = { engine: pragmas(app) for engine in app.extensions['sqlalchemy'].engines.values() }
+        for engine, wanted in engines.items():
+            if is_read_bind(app, engine):
+                # a read-only connection cannot switch the journal mode
+                wanted.pop('journal_mode', None)
+
+    for engine, wanted in engines.items():
+        if engine.dialect.name == 'sqlite' and wanted:
+            event.listen(engine, 'connect', functools.partial(_set_pragmas, wanted))
+
+    for engine, wanted in engines.items():
+        # in-memory databases ignore WAL and mmap and would not survive dispose()
+        if engine.dialect.name == 'sqlite' and not _is_memory(engine.url):
+            with app.app_context():
+                report(app, engine, wanted)
+
+
+def _set_pragmas(wanted, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in wanted.items():
+            cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+    finally:
+        cursor.close()
+
+
+def in_effect(engine) -> dict[str, str]:
+    """Read back every profile pragma on a fresh pooled connection."""
+    with engine.connect() as connection:
+        return { pragma: str(connection.exec_driver_sql('PRAGMA {}'.format(pragma)).scalar()).lower()
+                 for _, pragma in PRAGMAS }
+
+
+def report(app, engine, wanted : dict[str, str]):
+    try:
+        actual = in_effect(engine)
+    except sa.exc.OperationalError as e:
+        # a read-only bind cannot open a database nothing has written to yet
+        log = app.logger.info if is_read_bind(app, engine) else app.logger.warning
+        log('SQLite %s: cannot check pragmas: %s', engine.url.database, e.orig)
+        return
+    # the check must not leave connections behind for forked workers to share
+    engine.dispose()
+
+    app.logger.info('SQLite %s: %s', engine.url.database,
+                    ', '.join('{}={}'.format(pragma, value) for pragma, value in actual.items()))
+    for pragma, value in wanted.items():
+        expected = { 'synchronous': _SYNCHRONOUS, 'temp_store': _TEMP_STORE }.get(pragma, {}).get(value, value)
+        if actual[pragma] != expected:
+            app.logger.warning('SQLite %s: %s is %s, not %s', engine.url.database,
+                               pragma, actual[pragma], value)
+
+
+## Read/write routing
+
+_next_read = itertools.count()
+
+
+def _is_select(clause) -> bool:
+    if isinstance(clause, sa.TextClause):
+        return clause.text.lstrip()[:6].upper() == 'SELECT'
+    return getattr(clause, 'is_select', False)
+
+
+class RoutingSession(Session):
+    """Sends the SELECTs of GET and HEAD requests to the read binds, in turn.
+
+    Everything else goes to the primary: writes, `session.connection()` with
+    no statement (callers write through it), any statement made after the
+    session has written (so a request reads its own writes), and all work
+    outside a request, such as the CLI.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(clause):
+            return self._read_engine()
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self, clause) -> bool:
+        if self.info.get('cms_wrote'):
+            return False
+        if self._flushing or self.new or self.dirty or self.deleted \
+                or getattr(clause, 'is_dml', False):
+            self.info['cms_wrote'] = True
+            return False
+        return _is_select(clause) and has_request_context() \
+            and request.method in ('GET', 'HEAD') and bool(current_app.config['READ_BINDS'])
+
+    def _read_engine(self) -> sa.Engine:
+        # one read bind per session, so a request sees a single snapshot
+        key = self.info.get('cms_read_bind')
+        if key is None:
+            keys = current_app.config['READ_BINDS']
+            key = self.info['cms_read_bind'] = keys[next(_next_read) % len(keys)]
+        return self._db.engines[key]
@@ -0,0 +1,252 @@
+import os
+import json
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit, unquote
+
+import sqlalchemy as sa
+from flask import current_app, url_for
+
+from app import db
+from app.cards import CARD_COLUMNS
+from app.listing import encode_cursor
+from app.models import Post, User, Category, Tag, Widget, Comment
+
+# Static export of the `main` pages for a front server.
+#
+# `/tag/python?before=X` with `HX-Request` is written to
+# `tag/python/index.before=X.hx.html`, so nginx can serve the tree with
+#   try_files $uri/index$q$hx.html @flask;
+# where $q is "" or ".$args" and $hx is "" or ".hx".
+
+STATE = '.site-state.json'
+
+
+class Page(NamedTuple):
+    url : str
+    hx : bool
+    fingerprint : str
+
+
+@dataclass
+class BuildReport:
+    rendered : int = 0
+    unchanged : int = 0
+    removed : int = 0
+    errors : list[tuple[str, str]] = field(default_factory=list)
+
+
+def output_path(outdir : str, url : str, hx : bool) -> Optional[str]:
+    parts = urlsplit(url)
+    name = 'index{}{}.html'.format('.' + parts.query if parts.query else '', '.hx' if hx else '')
+    path = os.path.normpath(os.path.join(outdir, unquote(parts.path).lstrip('/'), name))
+    if os.path.commonpath([path, os.path.abspath(outdir)]) != os.path.abspath(outdir):
+        return None
+    return path
+
+
+def _write(path : str, data : bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _hash(*parts) -> str:
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+## Site map
+# Every page with a fingerprint built from cheap column queries; a page is
+# rendered again only when its fingerprint changes.
+
+def _layout() -> str:
+    """What the sidebar around full pages is drawn from."""
+    return _hash(
+        db.session.execute(sa.select(Widget.name, Widget.location, Widget.order, Widget.is_active,
+                                     Widget.lazy, Widget.additional_data).order_by(Widget.id)).all(),
+        db.session.execute(sa.select(Category.id, Category.category).order_by(Category.id)).all(),
+        db.session.execute(sa.select(Tag.id, Tag.tag, Tag.post_count).order_by(Tag.id)).all(),
+    )
+
+
+def _listing(endpoint : str, args : dict, posts : list, cards : dict,
+             per_page : int, layout : str) -> list[Page]:
+    """Every keyset page of one listing, under both the `before` cursor that
+    reaches it going forward and the `after` cursor that reaches it going back."""
+    chunks = [posts[start:start + per_page] for start in range(0, len(posts), per_page)] or [[]]
+    pages = []
+    for index, items in enumerate(chunks):
+        urls = [url_for(endpoint, **args) if index == 0 else
+                url_for(endpoint, before=encode_cursor(chunks[index - 1][-1]), **args)]
+        if index + 1 < len(chunks):
+            urls.append(url_for(endpoint, after=encode_cursor(chunks[index + 1][0]), **args))
+
+        content = [cards[post.id] for post in items] + [index == 0, index + 1 < len(chunks)]
+        for url in urls:
+            pages.append(Page(url, True, _hash(content)))
+            pages.append(Page(url, False, _hash(content, layout, args)))
+    return pages
+
+
+def site_pages() -> list[Page]:
+    per_page = current_app.config['PER_PAGE']
+    layout = _layout()
+
+    categories = dict(db.session.execute(sa.select(Category.id, Category.category)).all())
+    tags = dict(db.session.execute(sa.select(Tag.id, Tag.tag)).all())
+    users = { row.id: row for row in db.session.execute(
+        sa.select(User.id, User.username, User.fullname, User.email, User.about_me, User.joined)) }
+
+    # a card is drawn from its row alone
+    posts = db.session.execute(
+        sa.select(*CARD_COLUMNS).order_by(Post.timestamp.desc(), Post.id.desc())
+    ).all()
+    cards = { post.id: tuple(post) for post in posts }
+
+    pages = _listing('main.index', {}, posts, cards, per_page, layout)
+    # the home page answers on both of its rules
+    pages += [page._replace(url='/') for page in pages if page.url == url_for('main.index')]
+    for tag_id, name in tags.items():
+        pages += _listing('main.tag', { 'tagname': name },
+                          [post for post in posts if name in post.tag_names],
+                          cards, per_page, layout)
+    for category_id, name in categories.items():
+        pages += _listing('main.category', { 'categoryname': name },
+                          [post for post in posts if post.category_id == category_id],
+                          cards, per_page, layout)
+    for user in users.values():
+        pages += [page._replace(fingerprint=_hash(page.fingerprint, tuple(user)))
+                  for page in _listing('main.user', { 'username': user.username },
+                                       [post for post in posts if post.user_id == user.id],
+                                       cards, per_page, layout)]
+
+    about = db.session.scalar(sa.select(Widget.additional_data).where(Widget.name == 'about'))
+    pages.append(Page(url_for('main.about'), False, _hash(about, layout)))
+
+    slugs = { post.id: post.slug for post in posts }
+    for post in posts:
+        pages.append(Page(url_for('main.post', slug=post.slug), False, _hash(cards[post.id], layout)))
+
+    # lazily loaded comments, oldest first, as `main.comments` pages them
+    comments_per_page = current_app.config['COMMENTS_PER_PAGE']
+    comments = db.session.execute(
+        sa.select(Comment.post_id, Comment.id, Comment.timestamp, Comment.user_id)
+        .where(Comment.visible())
+        .order_by(Comment.post_id, Comment.timestamp, Comment.id)
+    )
+    commented = set()
+    for post_id, rows in groupby(comments, key=lambda row: row.post_id):
+        commented.add(post_id)
+        rows = list(rows)
+        for start in range(0, len(rows), comments_per_page):
+            args = { 'after': encode_cursor(rows[start - 1]) } if start else {}
+            items = rows[start:start + comments_per_page + 1]
+            content = [(row.id, users[row.user_id].fullname) for row in items]
+            pages.append(Page(url_for('main.comments', slug=slugs[post_id], **args), True,
+                              _hash(content)))
+    for post_id in slugs.keys() - commented:
+        pages.append(Page(url_for('main.comments', slug=slugs[post_id]), True, _hash(())))
+
+    for location, in db.session.execute(sa.select(Widget.location).where(Widget.is_active == True)):
+        if location in current_app.view_functions:
+            pages.append(Page(url_for(location), True, layout))
+    return pages
+
+
+## Rendering
+# Pages are fetched through the test client of an app built from the same
+# config, in each worker process.
+
+_client = None
+
+def _init_worker(config : dict):
+    global _client
+    from app import create_app
+    settings = type('ExportConfig', (), config)
+    _client = create_app(settings).test_client()
+
+def _render(job : tuple[str, bool, str]) -> tuple[str, bool, Optional[str]]:
+    url, hx, path = job
+    try:
+        response = _client.get(url, headers={ 'HX-Request': 'true' } if hx else {})
+        if response.status_code != 200:
+            return url, hx, '{} {}'.format(response.status_code, response.status)
+        _write(path, response.get_data())
+    except Exception as e:
+        return url, hx, repr(e)
+    return url, hx, None
+
+
+def _export_config() -> dict:
+    config = { key: value for key, value in current_app.config.items() if key.isupper() }
+    # whole bodies, no page cache entries, exceptions reported per page
+    config.update(TESTING=True, PAGE_CACHE='', STREAM_PAGES=False)
+    return config
+
+
+def build(outdir : str, jobs : Optional[int] = None, force=False) -> BuildReport:
+    """Render every page whose fingerprint changed since the last build into
+    `outdir`, in a pool of `jobs` processes, and drop pages that are gone."""
+    report = BuildReport()
+    outdir = os.path.abspath(outdir)
+    state_path = os.path.join(outdir, STATE)
+    try:
+        with open(state_path) as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        state = {}
+
+    with current_app.test_request_context():
+        pages = { '{}|{:d}'.format(page.url, page.hx): page for page in site_pages() }
+    todo = []
+    for key, page in pages.items():
+        path = output_path(outdir, page.url, page.hx)
+        if path is None:
+            report.errors.append((page.url, 'Outside the output directory'))
+        elif force or state.get(key) != page.fingerprint or not os.path.exists(path):
+            todo.append((page.url, page.hx, path))
+        else:
+            report.unchanged += 1
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(todo) < 2:
+        _init_worker(_export_config())
+        failed = _collect(map(_render, todo), report)
+    else:
+        chunksize = max(1, min(64, len(todo) // (jobs * 4)))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(_export_config(),)) as pool:
+            failed = _collect(pool.map(_render, todo, chunksize=chunksize), report)
+
+    for key in state.keys() - pages.keys():
+        url, hx = key.rsplit('|', 1)
+        path = output_path(outdir, url, hx == '1')
+        if path is not None and os.path.exists(path):
+            os.unlink(path)
+            report.removed += 1
+
+    new_state = { key: page.fingerprint for key, page in pages.items() if key not in failed }
+    _write(state_path, json.dumps(new_state, sort_keys=True).encode())
+    return report
+
+
+def _collect(results, report : BuildReport) -> set[str]:
+    failed = set()
+    for url, hx, error in results:
+        if error is None:
+            report.rendered += 1
+        else:
+            failed.add('{}|{:d}'.format(url, hx))
+            report.errors.append((url + (' (htmx)' if hx else ''), error))
+    return failed
@@ -0,0 +1,231 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+import sqlalchemy as sa
+from flask import render_template, stream_template, url_for, request, current_app, abort
+from werkzeug.http import is_resource_modified
+
+from app import db
+from app.metrics import cache_lookup
+from app.cache import posts_version, tags_version, categories_version, users_version
+from app.models import Post, User, Category, Tag, post_tags
+from app.feeds import bp
+
+# feeds and sitemaps show posts, their tags, categories and authors
+feed_stamps = (posts_version, tags_version, categories_version, users_version)
+
+
+class CachedFeed(NamedTuple):
+    tokens : tuple[int, ...]
+    xml : bytes
+    etag : str
+    last_modified : Optional[datetime]
+
+
+class FeedCache:
+    """Serialized feeds by URL, reused while `feed_stamps` are unchanged.
+
+    Bounded to `FEED_CACHE_MAX_ENTRIES`, least recently used first out.
+    """
+
+    def __init__(self):
+        self.max_entries = 256
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_entries = app.config['FEED_CACHE_MAX_ENTRIES']
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, key : str, render) -> CachedFeed:
+        tokens = tuple(stamp.token for stamp in feed_stamps)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached.tokens == tokens:
+                self._entries.move_to_end(key)
+                cache_lookup('feed', True)
+                return cached
+
+        cache_lookup('feed', False)
+        xml, last_modified = render()
+        xml = xml.encode()
+        feed = CachedFeed(tokens, xml, hashlib.sha1(xml).hexdigest(), last_modified)
+        with self._lock:
+            self._entries[key] = feed
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return feed
+
+
+feeds = FeedCache()
+
+
+## Utilities
+
+def _utc(value : Optional[datetime]) -> Optional[datetime]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+@bp.app_template_filter('rfc3339')
+def rfc3339(value : Optional[datetime]) -> str:
+    value = _utc(value) or datetime.now(timezone.utc).replace(microsecond=0)
+    return value.isoformat().replace('+00:00', 'Z')
+
+def _xml_response(body, etag : str, last_modified : Optional[datetime], mimetype : str):
+    """`body` with validators, or an empty 304 if the client's copy is current."""
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(body() if callable(body) else body,
+                                              mimetype=mimetype)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['FEED_MAX_AGE']
+    return response
+
+
+## Feeds
+
+def _entries(query : sa.Select) -> list:
+    """The newest posts matching `query` with only the columns a feed shows;
+    never `body`."""
+    return db.session.execute(
+        query.add_columns(Post.id, Post.slug, Post.title, Post.resume, Post.timestamp,
+                          Post.last_modified, Post.author_username, Post.author_name,
+                          Post.category_name, Post.tag_names)
+        .order_by(Post.timestamp.desc(), Post.id.desc())
+        .limit(current_app.config['FEED_LENGTH'])
+    ).all()
+
+def _feed(title : str, query : sa.Select, page_url : str):
+    def render():
+        entries = _entries(query)
+        updated = max((_utc(entry.last_modified) for entry in entries), default=None)
+        xml = render_template('feeds/atom.xml', title=title, entries=entries,
+                              updated=updated, feed_url=request.base_url, page_url=page_url)
+        return xml, updated
+
+    feed = feeds.get(request.base_url, render)
+    return _xml_response(feed.xml, feed.etag, feed.last_modified, 'application/atom+xml')
+
+# the Post columns come from `_entries`; these only add the filter
+_posts = sa.select().select_from(Post)
+
+@bp.route('/feed.xml')
+def site():
+    return _feed(current_app.config['FEED_TITLE'], _posts,
+                 url_for('main.index', _external=True))
+
+@bp.route('/tag/<tagname>/feed.xml')
+def tag(tagname : str):
+    tag_id = db.session.scalar(sa.select(Tag.id).where(Tag.tag == tagname))
+    if tag_id is None:
+        abort(404)
+    return _feed('{}: {}'.format(current_app.config['FEED_TITLE'], tagname),
+                 _posts.join(post_tags, post_tags.c.post_id == Post.id)
+                 .where(post_tags.c.tag_id == tag_id),
+                 url_for('main.tag', tagname=tagname, _external=True))
+
+@bp.route('/category/<categoryname>/feed.xml')
+def category(categoryname : str):
+    category_id = db.session.scalar(sa.select(Category.id).where(Category.category == categoryname))
+    if category_id is None:
+        abort(404)
+    return _feed('{}: {}'.format(current_app.config['FEED_TITLE'], categoryname),
+                 _posts.where(Post.category_id == category_id),
+                 url_for('main.category', categoryname=categoryname, _external=True))
+
+@bp.route('/user/<username>/feed.xml')
+def user(username : str):
+    user = db.session.execute(
+        sa.select(User.id, User.fullname).where(User.username == username)
+    ).first()
+    if user is None:
+        abort(404)
+    return _feed('{}: {}'.format(current_app.config['FEED_TITLE'], user.fullname),
+                 _posts.where(Post.user_id == user.id),
+                 url_for('main.user', username=username, _external=True))
+
+
+## Sitemap
+# One urlset while everything fits in SITEMAP_MAX_URLS, else an index of a
+# `pages` sitemap (home, about, listings) and numbered `posts` sitemaps.
+
+def _validators() -> tuple[int, Optional[datetime], str]:
+    count, newest = db.session.execute(
+        sa.select(sa.func.count(Post.id), sa.func.max(Post.last_modified))
+    ).one()
+    tokens = tuple(stamp.token for stamp in feed_stamps)
+    etag = hashlib.sha1(repr((count, newest, tokens, request.base_url)).encode()).hexdigest()
+    return count, _utc(newest), etag
+
+def _label_count() -> int:
+    return sum(db.session.scalar(sa.select(sa.func.count()).select_from(model))
+               for model in (Tag, Category, User))
+
+def _page_urls():
+    yield url_for('main.index', _external=True), None
+    yield url_for('main.about', _external=True), None
+    for name in db.session.scalars(sa.select(Tag.tag).order_by(Tag.id)):
+        yield url_for('main.tag', tagname=name, _external=True), None
+    for name in db.session.scalars(sa.select(Category.category).order_by(Category.id)):
+        yield url_for('main.category', categoryname=name, _external=True), None
+    for name in db.session.scalars(sa.select(User.username).order_by(User.id)):
+        yield url_for('main.user', username=name, _external=True), None
+
+def _post_urls(first_id : int = 0, limit : Optional[int] = None):
+    query = sa.select(Post.slug, Post.last_modified).where(Post.id >= first_id).order_by(Post.id)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = db.session.execute(query.execution_options(yield_per=1000))
+    for slug, last_modified in rows:
+        yield url_for('main.post', slug=slug, _external=True), last_modified
+
+def _sitemap(urls, etag : str, last_modified : Optional[datetime]):
+    return _xml_response(lambda: stream_template('feeds/sitemap.xml', urls=urls),
+                         etag, last_modified, 'application/xml')
+
+@bp.route('/sitemap.xml')
+def sitemap():
+    count, newest, etag = _validators()
+    per_file = current_app.config['SITEMAP_MAX_URLS']
+    if count + _label_count() + 2 <= per_file:
+        def urls():
+            yield from _page_urls()
+            yield from _post_urls()
+        return _sitemap(urls(), etag, newest)
+
+    sitemaps = [url_for('feeds.sitemap_pages', _external=True)] + \
+        [url_for('feeds.sitemap_posts', number=number, _external=True)
+         for number in range((count + per_file - 1) // per_file)]
+    xml = render_template('feeds/sitemap_index.xml', sitemaps=sitemaps, lastmod=newest)
+    return _xml_response(xml, etag, newest, 'application/xml')
+
+@bp.route('/sitemap-pages.xml')
+def sitemap_pages():
+    count, newest, etag = _validators()
+    return _sitemap(_page_urls(), etag, newest)
+
+@bp.route('/sitemap-posts-<int:number>.xml')
+def sitemap_posts(number : int):
+    count, newest, etag = _validators()
+    per_file = current_app.config['SITEMAP_MAX_URLS']
+    first_id = db.session.scalar(
+        sa.select(Post.id).order_by(Post.id).offset(number * per_file).limit(1)
+    )
+    if first_id is None:
+        abort(404)
+    return _sitemap(_post_urls(first_id, per_file), etag, newest)
@@ -0,0 +1,100 @@
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import sqlalchemy as sa
+from flask_login import UserMixin
+
+from app import db, login
+from app.cache import VersionStamp, users_version
+from app.metrics import cache_lookup
+from app.models import User
+
+
+@dataclass(frozen=True, eq=False)
+class Identity(UserMixin):
+    """What `current_user` is: a few columns of the logged in `User`.
+
+    It is shared between requests, so it never holds an ORM object. Anything
+    else is read from the `User` row, loaded on first use in the request.
+    """
+    id : int
+    username : str
+    fullname : str
+    email : str
+
+    @property
+    def user(self) -> User:
+        return db.session.get(User, self.id)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+
+class IdentityCache:
+    """Process-wide `Identity` per user id, used as the login user loader.
+
+    Every entry is dropped when `users_version` moves (any worker committed a
+    `User` change, password included) and expires after `USER_CACHE_TTL`.
+    """
+
+    def __init__(self, stamp : VersionStamp):
+        self.stamp = stamp
+        self.ttl = 60
+        self.max_entries = 4096
+        self._entries = OrderedDict()
+        self._token = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config['USER_CACHE_TTL']
+        self.max_entries = app.config['USER_CACHE_MAX_ENTRIES']
+        self.clear()
+        login.user_loader(self.load)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self, user_id : str) -> Optional[Identity]:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            return None
+
+        token = self.stamp.token
+        now = time.monotonic()
+        with self._lock:
+            if token != self._token:
+                self._entries.clear()
+                self._token = token
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                cache_lookup('identity', True)
+                return entry[1]
+
+        cache_lookup('identity', False)
+
+        row = db.session.execute(
+            sa.select(User.id, User.username, User.fullname, User.email)
+            .where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+
+        identity = Identity(*row)
+        with self._lock:
+            if token == self._token:
+                self._entries[user_id] = (now + self.ttl, identity)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return identity
+
+
+identities = IdentityCache(users_version)
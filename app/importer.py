@@ -0,0 +1,272 @@
+import os
+import re
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import islice
+from typing import NamedTuple, Optional
+
+import sqlalchemy as sa
+from markdown import Markdown
+from slugify import slugify
+
+from app import db
+from app.models import Post, User, Category, Tag, post_tags
+
+
+class SourceError(Exception):
+    pass
+
+
+class Source(NamedTuple):
+    """What is stored about the file a post was last imported from."""
+    id : int
+    source_path : Optional[str]
+    source_mtime : Optional[int]
+    content_hash : Optional[str]
+
+
+@dataclass
+class ParsedFile:
+    path : str
+    slug : str
+    source_path : str
+    source_mtime : int
+    content_hash : Optional[str] = None
+    title : Optional[str] = None
+    author : Optional[str] = None
+    category : Optional[str] = None
+    tags : list[str] = field(default_factory=list)
+    html : Optional[str] = None
+    error : Optional[str] = None
+
+    @property
+    def unchanged(self) -> bool:
+        return self.error is None and self.html is None
+
+
+@dataclass
+class ImportReport:
+    created : int = 0
+    updated : int = 0
+    skipped : int = 0
+    errors : list[tuple[str, str]] = field(default_factory=list)
+
+
+## Parsing
+# Runs in worker processes, so it must not touch the database.
+
+_md = None
+
+def _markdown() -> Markdown:
+    global _md
+    if _md is None:
+        _md = Markdown(extensions=['meta'])
+    return _md
+
+def locate(path : str) -> ParsedFile:
+    if not os.path.isfile(path):
+        raise SourceError('File not found')
+
+    if re.search(r'\.(md|txt)$', path, re.IGNORECASE) is None:
+        raise SourceError('Invalid file extension. Valid extensions: .md, .txt')
+
+    filename = os.path.split(path)[1]
+    return ParsedFile(
+        path=path,
+        slug=slugify(os.path.splitext(filename)[0]),
+        source_path=os.path.abspath(path),
+        source_mtime=os.stat(path).st_mtime_ns,
+    )
+
+def parse(source : ParsedFile, known_hash : Optional[str] = None) -> ParsedFile:
+    """Fill in `source` from its file.
+
+    Leaves `html` empty when the content hash equals `known_hash`.
+    """
+    with open(source.path, 'rb') as file:
+        raw = file.read()
+
+    source.content_hash = hashlib.sha256(raw).hexdigest()
+    if source.content_hash == known_hash:
+        return source
+
+    md = _markdown()
+    try:
+        html = md.convert(raw.decode())
+        meta = md.Meta
+    finally:
+        md.reset()
+
+    if not 'title' in meta.keys():
+        raise SourceError('Title not found')
+
+    if not 'author' in meta.keys():
+        raise SourceError('Author not found')
+
+    if not 'category' in meta.keys():
+        raise SourceError('Category not found')
+
+    source.title = meta['title'][0]
+    source.author = meta['author'][0]
+    source.category = meta['category'][0]
+    source.tags = list(dict.fromkeys(meta.get('tags', [])))
+    source.html = html
+    return source
+
+def _parse_job(job : tuple[ParsedFile, Optional[str]]) -> ParsedFile:
+    source, known_hash = job
+    try:
+        return parse(source, known_hash)
+    except (SourceError, OSError, UnicodeDecodeError) as e:
+        source.error = str(e)
+        return source
+
+
+## Database side
+
+def known_sources() -> dict[str, Source]:
+    rows = db.session.execute(
+        sa.select(Post.slug, Post.id, Post.source_path, Post.source_mtime, Post.content_hash)
+    )
+    return { slug: Source(*source) for slug, *source in rows }
+
+def is_unchanged(source : ParsedFile, stored : Optional[Source]) -> bool:
+    """Cheap stat check: same file, same mtime as the last import."""
+    return stored is not None and \
+        (stored.source_path, stored.source_mtime) == (source.source_path, source.source_mtime)
+
+def touch_sources(sources : list[ParsedFile], known : dict[str, Source]):
+    """Record the new path/mtime of files whose content did not change."""
+    if sources:
+        db.session.execute(sa.update(Post), [
+            { 'id': known[source.slug].id, 'source_path': source.source_path,
+              'source_mtime': source.source_mtime }
+            for source in sources
+        ])
+
+def _resolve(model, column, names : set[str]) -> dict:
+    found = { getattr(row, column.key): row for row in
+              db.session.scalars(sa.select(model).where(column.in_(names))) }
+    for name in names - found.keys():
+        found[name] = model(**{ column.key: name })
+        db.session.add(found[name])
+    return found
+
+def _batched(iterable, size : int):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def _apply_batch(batch : list[ParsedFile], known : dict[str, Source], report : ImportReport):
+    sources = []
+    for source in batch:
+        if source.error is not None:
+            report.errors.append((source.path, source.error))
+        elif source.unchanged:
+            report.skipped += 1
+        else:
+            sources.append(source)
+
+    touch_sources([source for source in batch if source.unchanged], known)
+
+    authors = { user.username: user for user in db.session.scalars(
+        sa.select(User).where(User.username.in_({ source.author for source in sources }))
+    ) }
+    sources, missing = [s for s in sources if s.author in authors], \
+        [s for s in sources if s.author not in authors]
+    report.errors.extend((source.path, 'Author doesn\'t exist in database') for source in missing)
+
+    unique = { source.slug: source for source in sources }
+    report.errors.extend((source.path, 'Another file in the batch has the same slug')
+                         for source in sources if unique[source.slug] is not source)
+    sources = list(unique.values())
+
+    categories = _resolve(Category, Category.category, { s.category for s in sources })
+    tags = Tag.find_tags({ name for s in sources for name in s.tags }, create_if_not_exists=True)
+    posts = { post.slug: post for post in db.session.scalars(
+        sa.select(Post).where(Post.slug.in_({ s.slug for s in sources }))
+    ) }
+    tagged = set(db.session.execute(
+        sa.select(post_tags.c.post_id, post_tags.c.tag_id)
+        .where(post_tags.c.post_id.in_([post.id for post in posts.values()]))
+    ).tuples())
+
+    created = updated = 0
+    for source in sources:
+        post = posts.get(source.slug)
+        if post is None:
+            created += 1
+            post = Post(slug=source.slug, title=source.title, body=source.html,
+                        author=authors[source.author], category=categories[source.category])
+            db.session.add(post)
+            posts[source.slug] = post
+        else:
+            updated += 1
+            post.last_modified = datetime.now(timezone.utc)
+            post.author = authors[source.author]
+            post.body = source.html
+            post.category = categories[source.category]
+            post.title = source.title
+
+        post.source_path = source.source_path
+        post.source_mtime = source.source_mtime
+        post.content_hash = source.content_hash
+
+        for name in source.tags:
+            tag = tags[name]
+            if post.id is None or tag.id is None or (post.id, tag.id) not in tagged:
+                post.tags.add(tag)
+                if post.id is not None and tag.id is not None:
+                    tagged.add((post.id, tag.id))
+
+    try:
+        db.session.commit()
+    except sa.exc.SQLAlchemyError as e:
+        db.session.rollback()
+        report.errors.extend((source.path, str(getattr(e, 'orig', None) or e)) for source in sources)
+        return
+
+    report.created += created
+    report.updated += updated
+    for post in posts.values():
+        known[post.slug] = Source(post.id, post.source_path, post.source_mtime, post.content_hash)
+
+def import_files(paths, batch_size : int, jobs : Optional[int] = None,
+                 force=False) -> ImportReport:
+    """Import many files: parse in a process pool, write in batches.
+
+    Authors, categories, tags and existing posts are looked up once per
+    batch with IN queries and each batch is committed in one transaction.
+    """
+    report = ImportReport()
+    known = known_sources()
+    jobs = jobs or os.cpu_count() or 1
+
+    pending = []
+    for path in paths:
+        try:
+            source = locate(path)
+        except SourceError as e:
+            report.errors.append((path, str(e)))
+            continue
+
+        stored = known.get(source.slug)
+        if not force and is_unchanged(source, stored):
+            report.skipped += 1
+            continue
+        pending.append((source, stored.content_hash if stored and not force else None))
+
+    if jobs == 1 or len(pending) < 2:
+        results = map(_parse_job, pending)
+        for batch in _batched(results, batch_size):
+            _apply_batch(batch, known, report)
+        return report
+
+    chunksize = max(1, min(64, len(pending) // (jobs * 4)))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(_parse_job, pending, chunksize=chunksize)
+        for batch in _batched(results, batch_size):
+            _apply_batch(batch, known, report)
+    return report
@@ -0,0 +1,160 @@
+import re
+import time
+import functools
+from collections import Counter
+from typing import Optional
+
+from blinker import Namespace
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+
+from app import db
+
+# Per-request SQL and render timings, off unless INSTRUMENTATION is set.
+#
+# Every response gets a `Server-Timing` header (db, render, total). Requests
+# slower than SLOW_REQUEST_MS and statements slower than SLOW_QUERY_MS are
+# logged, and so is any statement shape run REPEATED_QUERY_THRESHOLD times or
+# more by one request: the usual sign of a lazy load in a loop (N+1).
+#
+# With only METRICS on, requests and rendering are still timed for
+# `request_timed`, but statements are not.
+
+signals = Namespace()
+# sent with `timings` once the response is closed, streamed bodies included
+request_timed = signals.signal('request-timed')
+
+
+class RequestTimings:
+    """What one request spent, filled in by the engine and template hooks."""
+
+    __slots__ = ('started', 'endpoint', 'url', 'hx', 'status', 'statements', 'db',
+                 'render', 'shapes', '_depth', '_render_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.endpoint = request.endpoint
+        self.url = request.full_path.rstrip('?')
+        self.hx = request.headers.get('HX-Request') == 'true'
+        self.status = None
+        self.statements = 0
+        self.db = 0.0
+        self.render = 0.0
+        self.shapes = Counter()
+        self._depth = 0
+        self._render_started = 0.0
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        render = self.render
+        if self._depth:
+            # a streamed page is still rendering: count what was done so far
+            render += time.perf_counter() - self._render_started
+        return 'db;dur={:.1f};desc="{} queries", render;dur={:.1f}, total;dur={:.1f}'.format(
+            self.db * 1000, self.statements, render * 1000, self.total * 1000)
+
+
+def current() -> Optional[RequestTimings]:
+    return g.get('timings') if has_request_context() else None
+
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_lists = re.compile(r'\?(?:\s*,\s*\?)+')
+
+def shape(statement : str) -> str:
+    """`statement` with literals and IN lists folded, so the same query with
+    other values has the same shape."""
+    return _lists.sub('?', _literals.sub('?', statement))
+
+
+## Hooks
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('cms_started', []).append(time.perf_counter())
+
+def _after_execute(app, conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['cms_started'].pop()
+    timings = current()
+    if timings is not None:
+        timings.statements += 1
+        timings.db += elapsed
+        timings.shapes[shape(statement)] += 1
+
+    if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        app.logger.warning('Slow query (%.0f ms)%s: %s', elapsed * 1000,
+                           ' in ' + timings.url if timings is not None else '',
+                           ' '.join(statement.split())[:1000])
+
+def _execute_failed(context):
+    if context.connection is not None and context.connection.info.get('cms_started'):
+        context.connection.info['cms_started'].pop()
+
+def _render_started(sender, template, context, **extra):
+    timings = current()
+    if timings is not None:
+        if timings._depth == 0:
+            timings._render_started = time.perf_counter()
+        timings._depth += 1
+
+def _render_finished(sender, template, context, **extra):
+    timings = current()
+    if timings is not None and timings._depth:
+        timings._depth -= 1
+        if timings._depth == 0:
+            timings.render += time.perf_counter() - timings._render_started
+
+
+def _finish(app, timings : RequestTimings):
+    request_timed.send(app, timings=timings)
+    if not app.config['INSTRUMENTATION']:
+        return
+
+    total = timings.total * 1000
+    if total >= app.config['SLOW_REQUEST_MS']:
+        app.logger.warning('Slow request (%.0f ms) %s: %d queries in %.0f ms, render %.0f ms',
+                           total, timings.url, timings.statements, timings.db * 1000,
+                           timings.render * 1000)
+
+    threshold = app.config['REPEATED_QUERY_THRESHOLD']
+    for statement, count in timings.shapes.most_common():
+        if count < threshold:
+            break
+        app.logger.warning('Repeated query (%d times) in %s (%s): %s', count, timings.url,
+                           timings.endpoint, ' '.join(statement.split())[:1000])
+
+
+def init_app(app):
+    detailed = app.config['INSTRUMENTATION']
+    if not detailed and not app.config['METRICS']:
+        return
+
+    if detailed:
+        with app.app_context():
+            engines = set(db.engines.values())
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', _before_execute)
+            event.listen(engine, 'after_cursor_execute', functools.partial(_after_execute, app))
+            event.listen(engine, 'handle_error', _execute_failed)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+
+    # registered first so it runs before every other before_request hook and
+    # after every other after_request hook, page cache included
+    @app.before_request
+    def _start():
+        g.timings = RequestTimings()
+
+    @app.after_request
+    def _server_timing(response):
+        timings = g.get('timings')
+        if timings is None:
+            return response
+        timings.status = response.status_code
+        if detailed:
+            # for a streamed page the header can only cover its first chunk
+            response.headers['Server-Timing'] = timings.server_timing()
+        response.call_on_close(functools.partial(_finish, app, timings))
+        return response
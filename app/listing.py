@@ -0,0 +1,120 @@
+import base64
+import binascii
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import request, current_app
+
+from app import db
+from app.models import Post, Comment
+from app.cards import CARD_COLUMNS
+
+
+@dataclass
+class CursorPage:
+    """A page of rows plus the opaque cursors for its neighbours."""
+    items : list
+    next_cursor : Optional[str] = None
+    prev_cursor : Optional[str] = None
+
+
+def encode_cursor(row) -> str:
+    """Cursor for anything with a `timestamp` and an `id`."""
+    raw = '{}|{}'.format(row.timestamp.isoformat(), row.id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor : str) -> Optional[tuple[datetime, int]]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def paginate_posts(query : sa.Select) -> CursorPage:
+    """Keyset pagination over `(Post.timestamp, Post.id)`, newest first.
+
+    Reads `before` / `after` cursors from the request, or a legacy `page`
+    number which is served with a single OFFSET query. No COUNT is run.
+    `query` comes from `listing_select`; items are its rows.
+    """
+    per_page = current_app.config['PER_PAGE']
+    before = decode_cursor(request.args.get('before', ''))
+    after = decode_cursor(request.args.get('after', ''))
+    newest_first = (Post.timestamp.desc(), Post.id.desc())
+
+    if after is not None:
+        timestamp, post_id = after
+        rows = db.session.execute(
+            query.where(sa.or_(Post.timestamp > timestamp,
+                               sa.and_(Post.timestamp == timestamp, Post.id > post_id)))
+            .order_by(Post.timestamp.asc(), Post.id.asc()).limit(per_page + 1)
+        ).all()
+        has_prev = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        has_next = True
+    elif before is not None:
+        timestamp, post_id = before
+        rows = db.session.execute(
+            query.where(sa.or_(Post.timestamp < timestamp,
+                               sa.and_(Post.timestamp == timestamp, Post.id < post_id)))
+            .order_by(*newest_first).limit(per_page + 1)
+        ).all()
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = True
+    else:
+        page = max(request.args.get('page', 1, type=int), 1)
+        rows = db.session.execute(
+            query.order_by(*newest_first)
+            .limit(per_page + 1).offset((page - 1) * per_page)
+        ).all()
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = page > 1
+
+    return CursorPage(
+        items=items,
+        next_cursor=encode_cursor(items[-1]) if items and has_next else None,
+        prev_cursor=encode_cursor(items[0]) if items and has_prev else None,
+    )
+
+
+def paginate_comments(post_id : int) -> CursorPage:
+    """Visible comments of a post, oldest first, after the request's `after` cursor.
+
+    Walks the `(post_id, timestamp, id)` index, so the cost of a page does not
+    depend on how many comments the post has.
+    """
+    per_page = current_app.config['COMMENTS_PER_PAGE']
+    query = sa.select(Comment).options(so.joinedload(Comment.author)) \
+        .where(Comment.post_id == post_id, Comment.visible())
+
+    after = decode_cursor(request.args.get('after', ''))
+    if after is not None:
+        timestamp, comment_id = after
+        query = query.where(sa.or_(Comment.timestamp > timestamp,
+                                   sa.and_(Comment.timestamp == timestamp, Comment.id > comment_id)))
+
+    rows = db.session.scalars(
+        query.order_by(Comment.timestamp.asc(), Comment.id.asc()).limit(per_page + 1)
+    ).all()
+    items = rows[:per_page]
+    return CursorPage(
+        items=items,
+        next_cursor=encode_cursor(items[-1]) if len(rows) > per_page else None,
+    )
+
+
+def listing_select(query : sa.Select) -> sa.Select:
+    """Narrow a `select(Post)`, joins and filters included, to the card columns.
+
+    Pages of it are rows `_post.html` / `_header.html` draw without going back
+    to the database.
+    """
+    return query.with_only_columns(*CARD_COLUMNS)
@@ -0,0 +1,7 @@
+from flask_wtf import FlaskForm
+from wtforms import TextAreaField, SubmitField
+from wtforms.validators import DataRequired, Length
+
+class CommentForm(FlaskForm):
+    body = TextAreaField('Comment', validators=[DataRequired(), Length(max=512)])
+    submit = SubmitField('Send')
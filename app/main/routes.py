@@ -1,37 +1,43 @@
 import sqlalchemy as sa
-from flask import render_template, url_for, request, current_app, g
+from flask import render_template, url_for, request, current_app, redirect, abort
+from flask_login import current_user, login_required
 
 from app import db, htmx
-from app.models import Category, Tag, User, Post, Widget
+from app.models import Category, Tag, User, Post, Widget, Comment, post_tags
+from app.listing import listing_select, paginate_posts, paginate_comments
+from app.conditional import conditional, add_validators
+from app import search as fts
+from app.widgets.registry import registry
+from app.widgets.routes import inline_widget
 from app.main import bp
+from app.main.forms import CommentForm
+from app.streaming import render_page
 
-@bp.before_app_request
-def before_request():
-    query = sa.select(Widget).where(Widget.is_active == True)
-    widget_count = db.session.scalar(
-        sa.select(sa.func.count()).select_from(query)
-    )
-    g.cms_widgets = db.session.scalars(query.order_by(Widget.order.asc()))
-    g.cms_has_active_widgets = widget_count > 0
+@bp.app_context_processor
+def inject_widgets():
+    return {'cms_widgets': registry.active(), 'inline_widget': inline_widget}
+
+bp.after_request(add_validators)
 
 @bp.route('/')
 @bp.route('/index')
 def index():
-    page = request.args.get('page', 1, type=int)
-    query = sa.select(Post).order_by(Post.timestamp.desc())
-    posts = db.paginate(query, page=page,
-                        per_page=current_app.config['PER_PAGE'],
-                        error_out=False)
-    next_url = url_for('main.index', page=posts.next_num) \
-        if posts.has_next else None
-    prev_url = url_for('main.index', page=posts.prev_num) \
-        if posts.has_prev else None
+    query = listing_select(sa.select(Post))
+    posts = paginate_posts(query)
+    not_modified = conditional(posts.items)
+    if not_modified:
+        return not_modified
+
+    next_url = url_for('main.index', before=posts.next_cursor) \
+        if posts.next_cursor else None
+    prev_url = url_for('main.index', after=posts.prev_cursor) \
+        if posts.prev_cursor else None
     
     if htmx:
-        return render_template('partials/index.html', posts=posts.items,
+        return render_page('partials/index.html', posts=posts.items,
                                next_url=next_url, prev_url=prev_url)
     
-    return render_template('index.html', title='Home', posts=posts.items,
+    return render_page('index.html', title='Home', posts=posts.items,
                            next_url=next_url, prev_url=prev_url)
 
 @bp.route('/about')
@@ -47,8 +53,61 @@ def post(slug : str):
     post : Post= db.first_or_404(
         sa.select(Post).where(Post.slug == slug)
     )
+    not_modified = conditional([post])
+    if not_modified:
+        return not_modified
+
+    return render_page('post.html', post=post, title=post.title)
+
+@bp.route('/post/<slug>/comments')
+def comments(slug : str):
+    if not htmx:
+        return redirect(url_for('main.post', slug=slug, _anchor='comments'))
+
+    post_id = db.session.scalar(sa.select(Post.id).where(Post.slug == slug))
+    if post_id is None:
+        abort(404)
+
+    comments = paginate_comments(post_id)
+    next_url = url_for('main.comments', slug=slug, after=comments.next_cursor) \
+        if comments.next_cursor else None
+    return render_template('partials/comments.html', comments=comments.items,
+                           next_url=next_url)
+
+@bp.route('/post/<slug>/comment', methods=['GET','POST'])
+@login_required
+def add_comment(slug : str):
+    post_id = db.session.scalar(sa.select(Post.id).where(Post.slug == slug))
+    if post_id is None:
+        abort(404)
+
+    form = CommentForm()
+    if form.validate_on_submit():
+        db.session.add(Comment(post_id=post_id, user_id=current_user.id, body=form.body.data))
+        db.session.commit()
+        return render_template('partials/comment_form.html', slug=slug, form=None)
+
+    return render_template('partials/comment_form.html', slug=slug, form=form)
+
 
-    return render_template('post.html', post=post, title=post.title)
+@bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    hits, has_next = fts.search(q, page, current_app.config['PER_PAGE'])
+
+    cards = { card.id: card for card in db.session.execute(
+        listing_select(sa.select(Post).where(Post.id.in_([hit.post_id for hit in hits])))
+    ) }
+    results = [(cards[hit.post_id], hit.snippet) for hit in hits if hit.post_id in cards]
+
+    next_url = url_for('main.search', q=q, page=page + 1) if has_next else None
+    if htmx:
+        return render_template('partials/search.html', q=q, results=results,
+                               page=page, next_url=next_url)
+
+    return render_template('search.html', title='Search', q=q, results=results,
+                           page=page, next_url=next_url)
 
 
 @bp.route('/tag/<tagname>')
@@ -57,21 +116,26 @@ def tag(tagname : str):
         sa.select(Tag).where(Tag.tag == tagname)
     )
 
-    query = sa.select(Post).select_from(tag.posts.select()).order_by(Post.timestamp.desc())
-    page = request.args.get('page', 1, type=int)
-    posts = db.paginate(query, per_page=current_app.config['PER_PAGE'],
-                        page=page, error_out=False)
-    prev_url = url_for('main.tag', tagname=tagname, page=posts.prev_num) \
-        if posts.has_prev else None
-    next_url = url_for('main.tag', tagname=tagname, page=posts.next_num) \
-        if posts.has_next else None
+    query = listing_select(
+        sa.select(Post).join(post_tags, post_tags.c.post_id == Post.id)
+        .where(post_tags.c.tag_id == tag.id)
+    )
+    posts = paginate_posts(query)
+    not_modified = conditional(posts.items)
+    if not_modified:
+        return not_modified
+
+    prev_url = url_for('main.tag', tagname=tagname, after=posts.prev_cursor) \
+        if posts.prev_cursor else None
+    next_url = url_for('main.tag', tagname=tagname, before=posts.next_cursor) \
+        if posts.next_cursor else None
     
     if htmx:
-        return render_template('partials/index.html', posts=posts.items,
+        return render_page('partials/index.html', posts=posts.items,
                                next_url=next_url, prev_url=prev_url)
     
     title = 'Tag: {}'.format(tagname)
-    return render_template('index.html', posts=posts.items, title=title,
+    return render_page('index.html', posts=posts.items, title=title,
                            next_url=next_url, prev_url=prev_url)
 
 @bp.route('/category/<categoryname>')
@@ -79,22 +143,25 @@ def category(categoryname : str):
     category : Category = db.first_or_404(
         sa.select(Category).where(Category.category == categoryname)
     )
-    query = sa.select(Post).select_from(category.posts.select()).order_by(Post.timestamp.desc())
-    page = request.args.get('page', 1, type=int)
-    posts = db.paginate(query, page=page,
-                        per_page=current_app.config['PER_PAGE'],
-                        error_out=False)
-    prev_url = url_for('main.category', categoryname=categoryname, page=posts.prev_num) \
-        if posts.has_prev else None
-    next_url = url_for('main.category', categoryname=categoryname, page=posts.next_num) \
-        if posts.has_next else None
+    query = listing_select(
+        sa.select(Post).where(Post.category_id == category.id)
+    )
+    posts = paginate_posts(query)
+    not_modified = conditional(posts.items)
+    if not_modified:
+        return not_modified
+
+    prev_url = url_for('main.category', categoryname=categoryname, after=posts.prev_cursor) \
+        if posts.prev_cursor else None
+    next_url = url_for('main.category', categoryname=categoryname, before=posts.next_cursor) \
+        if posts.next_cursor else None
     
     if htmx:
-        return render_template('partials/index.html', posts=posts,
+        return render_page('partials/index.html', posts=posts.items,
                                prev_url=prev_url, next_url=next_url)
     
     title = 'Category: {}'.format(categoryname)
-    return render_template('index.html', title=title, posts=posts,
+    return render_page('index.html', title=title, posts=posts.items,
                            prev_url=prev_url, next_url=next_url)
 
 @bp.route('/user/<username>')
@@ -103,20 +170,24 @@ def user(username : str):
         sa.select(User).where(User.username == username)
     )
 
-    page = request.args.get('page', 1, type=int)
-    posts = db.paginate(user.posts.select(), page=page,
-                        per_page=current_app.config['PER_PAGE'],
-                        error_out=False)
+    query = listing_select(
+        sa.select(Post).where(Post.user_id == user.id)
+    )
+    posts = paginate_posts(query)
+    not_modified = conditional(posts.items)
+    if not_modified:
+        return not_modified
+
     
-    prev_url = url_for('main.user', username=username, page=posts.prev_num) \
-        if posts.has_prev else None
-    next_url = url_for('main.user', username=username, page=posts.next_num) \
-        if posts.has_next else None
+    prev_url = url_for('main.user', username=username, after=posts.prev_cursor) \
+        if posts.prev_cursor else None
+    next_url = url_for('main.user', username=username, before=posts.next_cursor) \
+        if posts.next_cursor else None
     
     if htmx:
-        return render_template('partials/index.html', posts=posts.items, 
+        return render_page('partials/index.html', posts=posts.items, 
                                next_url=next_url, prev_url=prev_url)
     
     title = 'User: {}'.format(user.fullname)
-    return render_template('user.html', user=user, posts=posts.items,
+    return render_page('user.html', user=user, posts=posts.items,
                            prev_url=prev_url, next_url=next_url, title=title)
\ No newline at end of file
@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import hmac
+import fcntl
+import atexit
+import tempfile
+import threading
+import ipaddress
+from collections import defaultdict
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from flask import current_app, request, abort
+
+from app import db, database
+from app.instrument import request_timed
+
+# Prometheus metrics for the whole node, off unless METRICS is set.
+#
+# Each worker counts in memory and writes its values to METRICS_DIR/<pid>.json
+# every METRICS_WRITE_INTERVAL seconds and when it exits. `/metrics` adds up
+# the files; counters of workers that are gone are folded into archive.json,
+# so totals never go back, while their gauges are dropped.
+#
+# `/metrics` answers the networks in METRICS_ALLOW and, when METRICS_TOKEN is
+# set, only with `Authorization: Bearer <token>`. A loopback-only list, the
+# default, also requires the token.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'cms_request_duration_seconds': ('histogram', 'Time to answer a request, streamed body included', LATENCY_BUCKETS),
+    'cms_template_render_seconds': ('histogram', 'Time spent rendering templates in a request', LATENCY_BUCKETS),
+    'cms_db_pool_checkouts_total': ('counter', 'Connections taken from the pool', None),
+    'cms_db_pool_checkout_wait_seconds': ('histogram', 'Time waited for a connection from the pool', CHECKOUT_BUCKETS),
+    'cms_db_pool_timeouts_total': ('counter', 'Checkouts that gave up after DB_POOL_TIMEOUT', None),
+    'cms_db_connections_opened_total': ('counter', 'New database connections', None),
+    'cms_db_pool_checked_out': ('gauge', 'Connections in use', None),
+    'cms_cache_requests_total': ('counter', 'Cache lookups by cache and result', None),
+    'cms_activity_pending': ('gauge', 'last_seen updates waiting to be written', None),
+}
+
+
+class Registry:
+    """This worker's metric values, shared with the other workers through files."""
+
+    def __init__(self):
+        self.directory = None
+        self.interval = 5.0
+        self._values = defaultdict(float)
+        self._gauges = []
+        self._written = 0.0
+        self._claimed = None
+        self._hooked = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = app.config['METRICS_DIR']
+        self.interval = app.config['METRICS_WRITE_INTERVAL']
+        self._gauges = []
+        os.makedirs(self.directory, exist_ok=True)
+        if not self._hooked:
+            atexit.register(self.write)
+            os.register_at_fork(after_in_child=self._forked)
+            self._hooked = True
+
+    def _forked(self):
+        self._values.clear()
+        self._written = 0.0
+
+    def inc(self, name : str, labels : tuple = (), amount : float = 1.0):
+        if self.directory is None:
+            return
+        with self._lock:
+            self._values[(name, labels)] += amount
+
+    def observe(self, name : str, labels : tuple, value : float):
+        if self.directory is None:
+            return
+        buckets = METRICS[name][2]
+        le = next((str(bound) for bound in buckets if value <= bound), '+Inf')
+        with self._lock:
+            self._values[(name + '_bucket', labels + (('le', le),))] += 1
+            self._values[(name + '_sum', labels)] += value
+            self._values[(name + '_count', labels)] += 1
+
+    def gauge(self, name : str, read):
+        """Sample `read() -> [(labels, value)]` whenever values are written."""
+        self._gauges.append((name, read))
+
+    def maybe_write(self):
+        if time.monotonic() - self._written >= self.interval:
+            self.write()
+
+    ## Files
+
+    def _path(self, name : str) -> str:
+        return os.path.join(self.directory, name)
+
+    def write(self):
+        if self.directory is None:
+            return
+        pid = os.getpid()
+        if self._claimed != pid:
+            # a file left by an earlier worker with the same pid is archived first
+            with self._locked():
+                self._archive([self._path('{}.json'.format(pid))])
+            self._claimed = pid
+
+        self._written = time.monotonic()
+        with self._lock:
+            values = [[name, labels, value] for (name, labels), value in self._values.items()]
+        gauges = [[name, labels, value] for name, read in self._gauges for labels, value in read()]
+        _write_json(self._path('{}.json'.format(pid)), { 'values': values, 'gauges': gauges })
+
+    def _locked(self):
+        return _FileLock(self._path('.lock'))
+
+    def _archive(self, paths : list[str]):
+        """Fold the counters of `paths` into archive.json and remove them.
+        Must hold the lock."""
+        paths = [path for path in paths if os.path.exists(path)]
+        if not paths:
+            return
+        archive = _read_json(self._path('archive.json')) or { 'values': [] }
+        totals = _sum([archive] + [_read_json(path) or {} for path in paths], 'values')
+        _write_json(self._path('archive.json'),
+                    { 'values': [[name, labels, value] for (name, labels), value in totals.items()] })
+        for path in paths:
+            os.unlink(path)
+
+    def collect(self) -> tuple[dict, dict]:
+        """Counter and gauge totals over every worker on the node."""
+        self.write()
+        with self._locked():
+            files = [name for name in os.listdir(self.directory)
+                     if name.endswith('.json') and name[:-5].isdigit()]
+            self._archive([self._path(name) for name in files if not _alive(int(name[:-5]))])
+            live = [data for data in (_read_json(self._path(name)) for name in files
+                                      if _alive(int(name[:-5]))) if data]
+            archive = _read_json(self._path('archive.json')) or {}
+        return _sum(live + [archive], 'values'), _sum(live, 'gauges')
+
+
+class _FileLock:
+    def __init__(self, path : str):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def _alive(pid : int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_json(path : str):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path : str, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(data, file)
+    os.replace(tmp, path)
+
+
+def _sum(snapshots : list[dict], key : str) -> dict:
+    totals = defaultdict(float)
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get(key, ()):
+            totals[(name, tuple(tuple(pair) for pair in labels))] += value
+    return totals
+
+
+registry = Registry()
+
+
+def cache_lookup(cache : str, hit : bool):
+    registry.inc('cms_cache_requests_total', (('cache', cache), ('result', 'hit' if hit else 'miss')))
+
+
+## Exposition
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _series(name : str, labels : tuple, value : float) -> str:
+    if labels:
+        name += '{' + ','.join('{}="{}"'.format(key, _escape(label)) for key, label in labels) + '}'
+    return '{} {}'.format(name, repr(float(value)) if value != int(value) else int(value))
+
+def exposition(values : dict, gauges : dict) -> str:
+    lines = []
+    for name, (kind, help, buckets) in METRICS.items():
+        lines += ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, kind)]
+        if kind == 'gauge':
+            lines += [_series(name, labels, value)
+                      for (series, labels), value in sorted(gauges.items()) if series == name]
+        elif kind == 'counter':
+            lines += [_series(name, labels, value)
+                      for (series, labels), value in sorted(values.items()) if series == name]
+        else:
+            for labels in sorted(labels for series, labels in values if series == name + '_count'):
+                total = 0
+                for bound in [str(bound) for bound in buckets] + ['+Inf']:
+                    total += values.get((name + '_bucket', labels + (('le', bound),)), 0)
+                    lines.append(_series(name + '_bucket', labels + (('le', bound),), total))
+                lines.append(_series(name + '_sum', labels, values[(name + '_sum', labels)]))
+                lines.append(_series(name + '_count', labels, values[(name + '_count', labels)]))
+    return '\n'.join(lines) + '\n'
+
+
+def _networks(app) -> list:
+    return [ipaddress.ip_network(network.strip(), strict=False)
+            for network in app.config['METRICS_ALLOW'].split(',') if network.strip()]
+
+def _loopback_only(networks) -> bool:
+    # behind a local reverse proxy every request comes from loopback, so
+    # such a list alone does not keep anyone out
+    return bool(networks) and all(network.is_loopback for network in networks)
+
+def _allowed() -> bool:
+    config = current_app.config
+    networks = _networks(current_app)
+    if _loopback_only(networks) and not config['METRICS_TOKEN']:
+        return False
+    if networks:
+        try:
+            address = ipaddress.ip_address(request.remote_addr or '')
+        except ValueError:
+            return False
+        if not any(address in network for network in networks):
+            return False
+    token = config['METRICS_TOKEN']
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token)
+    return True
+
+def metrics_view():
+    if not _allowed():
+        abort(403)
+    response = current_app.response_class(exposition(*registry.collect()),
+                                          mimetype='text/plain; version=0.0.4')
+    response.cache_control.no_store = True
+    return response
+
+
+## Sources
+
+class TimedQueuePool(sa.pool.QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa.exc.TimeoutError:
+            registry.inc('cms_db_pool_timeouts_total')
+            raise
+        finally:
+            registry.observe('cms_db_pool_checkout_wait_seconds', (), time.perf_counter() - started)
+
+
+def configure(app):
+    """Time pool checkouts. Must run after `database.configure`, before `db.init_app`."""
+    if not app.config['METRICS']:
+        return
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if 'pool_size' in options:
+        options.setdefault('poolclass', TimedQueuePool)
+
+    # SQLALCHEMY_ENGINE_OPTIONS only reach the primary
+    binds = app.config['SQLALCHEMY_BINDS']
+    for key in app.config['READ_BINDS']:
+        bind = binds[key] if isinstance(binds[key], dict) else { 'url': binds[key] }
+        if not database._is_memory(sa.engine.make_url(bind['url'])):
+            bind.setdefault('poolclass', TimedQueuePool)
+        binds[key] = bind
+
+
+def _request_timed(sender, timings):
+    labels = (('endpoint', timings.endpoint or ''), ('mode', 'hx' if timings.hx else 'full'))
+    registry.observe('cms_request_duration_seconds', labels, timings.total)
+    if timings.render:
+        registry.observe('cms_template_render_seconds', labels, timings.render)
+    registry.maybe_write()
+
+
+def init_app(app):
+    if not app.config['METRICS']:
+        return
+    registry.init_app(app)
+
+    with app.app_context():
+        engines = dict(db.engines)
+    for key, engine in engines.items():
+        labels = (('bind', key or 'default'),)
+        event.listen(engine, 'checkout',
+                     lambda *args, labels=labels: registry.inc('cms_db_pool_checkouts_total', labels))
+        event.listen(engine, 'connect',
+                     lambda *args, labels=labels: registry.inc('cms_db_connections_opened_total', labels))
+
+    def checked_out():
+        return [((('bind', key or 'default'),), engine.pool.checkedout())
+                for key, engine in engines.items() if hasattr(engine.pool, 'checkedout')]
+    registry.gauge('cms_db_pool_checked_out', checked_out)
+
+    from app.activity import last_seen
+    registry.gauge('cms_activity_pending', lambda: [((), last_seen.pending)])
+
+    request_timed.connect(_request_timed, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    if _loopback_only(_networks(app)) and not app.config['METRICS_TOKEN']:
+        app.logger.warning('/metrics is closed: METRICS_ALLOW only lists loopback addresses, '
+                           'set METRICS_TOKEN to scrape it')
@@ -1,8 +1,11 @@
-from app import db, login
+from app import db
+from app.cache import watch, mark_changed, widgets_version, categories_version, tags_version, posts_version, \
+    users_version
 import sqlalchemy as sa
 from sqlalchemy import event
 import sqlalchemy.orm as so
-from typing import Optional, Union
+from typing import Iterable, Optional, Union
+from blinker import Namespace
 from datetime import datetime, timedelta, timezone
 from flask import current_app
 from flask_login import UserMixin
@@ -10,9 +13,18 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 
 
+signals = Namespace()
+# sent with `tag_ids` when post_tags rows are written directly, bypassing
+# the Post.tags collection events
+post_tags_changed = signals.signal('post-tags-changed')
+# sent with `post_ids` when comments are moderated in bulk
+comments_changed = signals.signal('comments-changed')
+
 post_tags = sa.Table('post_tags', db.metadata,
                      sa.Column('post_id', sa.Integer, sa.ForeignKey('post.id')),
                      sa.Column('tag_id', sa.Integer, sa.ForeignKey('tag.id')),
+                     sa.Index('ix_post_tags_post_id_tag_id', 'post_id', 'tag_id'),
+                     sa.Index('ix_post_tags_tag_id_post_id', 'tag_id', 'post_id'),
                      )
 
 class User(db.Model, UserMixin):
@@ -25,6 +37,7 @@ class User(db.Model, UserMixin):
     joined : so.Mapped[datetime] = so.mapped_column(sa.DateTime, default=lambda: datetime.now(timezone.utc))
     last_seen : so.Mapped[datetime] = so.mapped_column(sa.DateTime, default=lambda: datetime.now(timezone.utc))
     posts : so.WriteOnlyMapped['Post'] = so.relationship(back_populates='author')
+    comments : so.WriteOnlyMapped['Comment'] = so.relationship(back_populates='author')
 
 
     def __repr__(self):
@@ -50,10 +63,6 @@ class User(db.Model, UserMixin):
         return user
         
     
-@login.user_loader
-def load_user(id):
-    return db.session.get(User, int(id))
-
 class Post(db.Model):
     id : so.Mapped[int] = so.mapped_column(primary_key=True)
     slug : so.Mapped[str] = so.mapped_column(sa.String(128), index=True, unique=True)
@@ -62,11 +71,30 @@ class Post(db.Model):
     resume : so.Mapped[Optional[str]] = so.mapped_column(sa.Text, deferred=True)
     timestamp : so.Mapped[datetime] = so.mapped_column(sa.DateTime, default=lambda: datetime.now(timezone.utc))
     last_modified : so.Mapped[datetime] = so.mapped_column(sa.DateTime, default=lambda: datetime.now(timezone.utc))
+    comment_count : so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    source_path : so.Mapped[Optional[str]] = so.mapped_column(sa.String(1024))
+    source_mtime : so.Mapped[Optional[int]] = so.mapped_column(sa.BigInteger)
+    content_hash : so.Mapped[Optional[str]] = so.mapped_column(sa.String(64))
     user_id : so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), index=True)
     author : so.Mapped['User'] = so.relationship(back_populates='posts')
     category_id : so.Mapped[int] = so.mapped_column(sa.ForeignKey('category.id'), index=True)
     category : so.Mapped['Category'] = so.relationship(back_populates='posts')
     tags : so.WriteOnlyMapped['Tag'] = so.relationship(secondary=post_tags, back_populates='posts')
+    comments : so.WriteOnlyMapped['Comment'] = so.relationship(back_populates='post')
+    # listing card, kept up to date by app.cards
+    excerpt : so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    word_count : so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    reading_time : so.Mapped[int] = so.mapped_column(sa.Integer, default=1, server_default='1')
+    author_username : so.Mapped[Optional[str]] = so.mapped_column(sa.String(64))
+    author_name : so.Mapped[Optional[str]] = so.mapped_column(sa.String(128))
+    category_name : so.Mapped[Optional[str]] = so.mapped_column(sa.String(128))
+    tag_names : so.Mapped[list[str]] = so.mapped_column(sa.JSON, default=list, server_default='[]')
+
+    __table_args__ = (
+        sa.Index('ix_post_timestamp_id', 'timestamp', 'id'),
+        sa.Index('ix_post_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        sa.Index('ix_post_category_id_timestamp_id', 'category_id', 'timestamp', 'id'),
+    )
 
     def __repr__(self):
         return '<Post {}>'.format(self.title)
@@ -82,31 +110,71 @@ class Post(db.Model):
     def taglist(self):
         return db.session.scalars(self.tags.select())
     
-    
-    def comment_count(self):
-        return db.session.scalar(
-            sa.select(sa.func.count()).select_from(self.comments.select())
-        )
-    
-    def _in_taglist(self, tag_id: int):
-        query = self.tags.select().where(Tag.id == tag_id)
-        return db.session.scalar(query) is not None
+    def _in_taglist(self, tag_ids: Iterable[int]) -> set[int]:
+        if self.id is None:
+            return set()
+        query = self.tags.select().with_only_columns(Tag.id).where(Tag.id.in_(tag_ids))
+        return set(db.session.scalars(query))
     
     def add_tags(self, tags: Union['Tag', list]):
         if isinstance(tags, Tag):
             tags = [ tags ]
 
+        present = self._in_taglist([tag.id for tag in tags if tag.id is not None])
         for tag in tags:
-            if not self._in_taglist(tag.id):
+            if tag.id is None or tag.id not in present:
                 self.tags.add(tag)
+                present.add(tag.id)
 
     def remove_tags(self, tags: Union['Tag', list]):
         if isinstance(tags, Tag):
             tags = [ tags ]
 
+        present = self._in_taglist([tag.id for tag in tags if tag.id is not None])
         for tag in tags:
-            if self._in_taglist(tag.id):
+            if tag.id in present:
                 self.tags.remove(tag)
+                present.discard(tag.id)
+
+    def set_tags(self, tagnames: Iterable[str], merge=False) -> dict[str, 'Tag']:
+        """Make `tagnames` the post's tags, creating missing `Tag` rows.
+
+        With `merge` the names are added to the current tags instead of
+        replacing them. Runs a fixed number of statements whatever the
+        number of tags; post_tags is written with one INSERT and one DELETE.
+        """
+        tags = Tag.find_tags(tagnames, create_if_not_exists=True)
+        if self.id is None:
+            db.session.flush()
+
+        current = set(db.session.scalars(
+            sa.select(post_tags.c.tag_id).where(post_tags.c.post_id == self.id)
+        ))
+        wanted = { tag.id for tag in tags.values() }
+        added = wanted - current
+        removed = set() if merge else current - wanted
+
+        if added:
+            db.session.execute(sa.insert(post_tags), [
+                { 'post_id': self.id, 'tag_id': tag_id } for tag_id in added
+            ])
+        if removed:
+            db.session.execute(sa.delete(post_tags).where(
+                post_tags.c.post_id == self.id, post_tags.c.tag_id.in_(removed)
+            ))
+
+        changed = added | removed
+        if changed:
+            recount_tags(db.session.connection(), changed)
+            for tag in tags.values():
+                db.session.expire(tag, ['post_count'])
+            mark_changed(db.session(), tags_version)
+            post_tags_changed.send(self, session=db.session(), tag_ids=changed)
+
+        return tags
+
+    def merge_tags(self, tagnames: Iterable[str]) -> dict[str, 'Tag']:
+        return self.set_tags(tagnames, merge=True)
 
     @staticmethod
     def get_by_slug(slug: str):
@@ -114,9 +182,66 @@ class Post(db.Model):
             sa.select(Post).where(Post.slug == slug)
         )
 
-@event.listens_for(Post, 'before_insert')
-def get_resume(mapper, connect, target):
-    target.resume = target.body[:(target.body.find('</p>') + 4)]
+class Comment(db.Model):
+    id : so.Mapped[int] = so.mapped_column(primary_key=True)
+    user_id : so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), index=True)
+    author : so.Mapped['User'] = so.relationship(back_populates='comments')
+    post_id : so.Mapped[int] = so.mapped_column(sa.ForeignKey('post.id'), index=True)
+    post : so.Mapped['Post'] = so.relationship(back_populates='comments')
+    body : so.Mapped[str] = so.mapped_column(sa.String(512))
+    timestamp : so.Mapped[datetime] = so.mapped_column(sa.DateTime, index=True, default=lambda: datetime.now(timezone.utc))
+    approved : so.Mapped[bool] = so.mapped_column(sa.Boolean, default=False)
+    blocked : so.Mapped[bool] = so.mapped_column(sa.Boolean, default=False)
+    approved_by : so.Mapped[Optional[str]] = so.mapped_column(sa.String(64))
+    blocked_by : so.Mapped[Optional[str]] = so.mapped_column(sa.String(64))
+
+    __table_args__ = (
+        sa.Index('ix_comment_post_id_timestamp', 'post_id', 'timestamp', 'id'),
+        sa.Index('ix_comment_approved_blocked', 'approved', 'blocked'),
+    )
+
+    def __repr__(self):
+        return '<Comment {}>'.format(self.id)
+
+    @staticmethod
+    def visible():
+        return sa.and_(Comment.approved == True, Comment.blocked == False)
+
+    @staticmethod
+    def pending():
+        return sa.and_(Comment.approved == False, Comment.blocked == False)
+
+    @staticmethod
+    def moderate(comment_ids : Iterable[int], approve : bool, moderator : str) -> int:
+        """Approve or block many comments with one UPDATE.
+
+        Only the posts the comments belong to are recounted. Returns the
+        number of comments changed.
+        """
+        comment_ids = list(comment_ids)
+        if not comment_ids:
+            return 0
+
+        post_ids = set(db.session.scalars(
+            sa.select(Comment.post_id).distinct().where(Comment.id.in_(comment_ids))
+        ))
+        if approve:
+            values = { 'approved': True, 'blocked': False, 'approved_by': moderator }
+        else:
+            values = { 'approved': False, 'blocked': True, 'blocked_by': moderator }
+        result = db.session.execute(
+            sa.update(Comment).where(Comment.id.in_(comment_ids)).values(**values)
+        )
+
+        recount_comments(db.session.connection(), post_ids)
+        for post_id in post_ids:
+            post = db.session.identity_map.get(db.session.identity_key(Post, post_id))
+            if post is not None:
+                db.session.expire(post, ['comment_count'])
+        # the counts are not post writes the ORM sees
+        mark_changed(db.session(), posts_version)
+        comments_changed.send(Comment, session=db.session(), post_ids=post_ids)
+        return result.rowcount
 
 class Category(db.Model):
     id : so.Mapped[int] = so.mapped_column(primary_key=True)
@@ -142,17 +267,33 @@ class Category(db.Model):
 class Tag(db.Model):
     id : so.Mapped[int] = so.mapped_column(primary_key=True)
     tag : so.Mapped[str] = so.mapped_column(sa.String(32))
+    post_count : so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
     posts : so.WriteOnlyMapped['Post'] = so.relationship(secondary=post_tags, back_populates='tags')
 
     def __repr__(self):
         return '<Tag {}>'.format(self.tag)
     
-    @property
-    def count(self) -> int:
-        return db.session.scalar(
-            sa.select(sa.func.count()).select_from(self.posts.select().subquery())
-        )
-    
+    @staticmethod
+    def find_tags(tagnames : Iterable[str], create_if_not_exists=False) -> dict[str, 'Tag']:
+        names = set(tagnames)
+        if not names:
+            return {}
+
+        tags = { tag.tag: tag for tag in db.session.scalars(
+            sa.select(Tag).where(Tag.tag.in_(names))
+        ) }
+
+        missing = names - tags.keys()
+        if missing and create_if_not_exists:
+            created = db.session.scalars(
+                sa.insert(Tag).returning(Tag),
+                [ { 'tag': name, 'post_count': 0 } for name in missing ]
+            )
+            tags.update((tag.tag, tag) for tag in created)
+            mark_changed(db.session(), tags_version)
+
+        return tags
+
     @staticmethod
     def find_tag(tagname : str, create_if_not_exists=False):
         tag = db.session.scalar(
@@ -165,12 +306,79 @@ class Tag(db.Model):
 
         return tag
     
+## Counters
+# Tag.post_count and Post.comment_count are recounted in SQL for the rows a
+# flush touched, so they stay exact whatever path changed the collections.
+
+def recount_tags(connection, tag_ids=None):
+    tag = Tag.__table__
+    stmt = sa.update(tag).values(post_count=sa.select(sa.func.count())
+        .where(post_tags.c.tag_id == tag.c.id).scalar_subquery())
+    if tag_ids is not None:
+        stmt = stmt.where(tag.c.id.in_(tag_ids))
+    connection.execute(stmt)
+
+def recount_comments(connection, post_ids=None):
+    post = Post.__table__
+    comment = Comment.__table__
+    stmt = sa.update(post).values(comment_count=sa.select(sa.func.count())
+        .where(comment.c.post_id == post.c.id, comment.c.approved == True,
+               comment.c.blocked == False).scalar_subquery())
+    if post_ids is not None:
+        stmt = stmt.where(post.c.id.in_(post_ids))
+    connection.execute(stmt)
+
+@event.listens_for(Post.tags, 'append')
+@event.listens_for(Post.tags, 'remove')
+def _tags_changed(target, value, initiator):
+    session = so.object_session(target) or so.object_session(value)
+    if session is not None:
+        session.info.setdefault('cms_recount_tags', set()).add(value)
+
+@event.listens_for(Comment, 'after_insert')
+def _comment_added(mapper, connection, target):
+    # comments awaiting moderation are not counted
+    if target.approved and not target.blocked:
+        _comments_changed(mapper, connection, target)
+
+@event.listens_for(Comment, 'after_update')
+@event.listens_for(Comment, 'after_delete')
+def _comments_changed(mapper, connection, target):
+    session = so.object_session(target)
+    if session is not None:
+        post_ids = session.info.setdefault('cms_recount_comments', set())
+        post_ids.add(target.post_id)
+        post_ids.update(sa.inspect(target).attrs.post_id.history.deleted)
+
+@event.listens_for(so.Session, 'after_flush_postexec')
+def _update_counters(session, flush_context):
+    tags = session.info.pop('cms_recount_tags', None)
+    if tags:
+        recount_tags(session.connection(), [tag.id for tag in tags])
+        for tag in tags:
+            if tag in session:
+                session.expire(tag, ['post_count'])
+
+    post_ids = session.info.pop('cms_recount_comments', None)
+    if post_ids:
+        recount_comments(session.connection(), post_ids)
+        for post_id in post_ids:
+            post = session.identity_map.get(session.identity_key(Post, post_id))
+            if post is not None:
+                session.expire(post, ['comment_count'])
+
+@event.listens_for(so.Session, 'after_rollback')
+def _discard_counters(session):
+    session.info.pop('cms_recount_tags', None)
+    session.info.pop('cms_recount_comments', None)
+
 class Widget(db.Model):
     id : so.Mapped[int] = so.mapped_column(primary_key=True)
     name : so.Mapped[str] = so.mapped_column(sa.String(32), index=True)
     location: so.Mapped[str] = so.mapped_column(sa.String(32))
     order : so.Mapped[int] = so.mapped_column(sa.Integer, index=True, unique=True)
     is_active : so.Mapped[bool] = so.mapped_column(sa.Boolean, default=False)
+    lazy : so.Mapped[bool] = so.mapped_column(sa.Boolean, default=False, server_default=sa.false())
     additional_data : so.Mapped[Optional[str]] = so.mapped_column(sa.Text, deferred=True)
 
     def __repr__(self):
@@ -185,3 +393,9 @@ class SocialNetwork(db.Model):
 
     def __repr__(self):
         return '<SocialNetwork {}>'.format(self.social)
+
+watch(widgets_version, Widget)
+watch(categories_version, Category)
+watch(tags_version, Tag)
+watch(posts_version, Post)
+watch(users_version, User)
@@ -0,0 +1,371 @@
+import os
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from urllib.parse import urlencode
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy import event
+from flask import request, session, g, current_app
+from flask_login import current_user
+
+from app.cache import mark_changed, page_stamps
+from app.models import Post, Tag, Category, Widget, User, Comment, \
+    post_tags_changed, comments_changed
+from app.metrics import cache_lookup
+
+
+class CachedResponse(NamedTuple):
+    versions : tuple[int, ...]
+    status : int
+    headers : list[tuple[str, str]]
+    body : bytes
+
+
+## Backends
+
+class MemoryBackend:
+    """In-process LRU bounded by entry count and total body size."""
+
+    def __init__(self, max_entries : int, max_bytes : int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key : str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key : str, entry : CachedResponse):
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.body)
+            self._entries[key] = entry
+            self._size += len(entry.body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.body)
+
+    def delete(self, key : str):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class FileBackend:
+    """One pickle per key under a directory shared by every worker.
+
+    Bounded like MemoryBackend; a hit touches the file, so the least
+    recently used are the oldest and go first.
+    """
+
+    def __init__(self, directory : str, max_entries : int, max_bytes : int):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key : str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key : str) -> Optional[CachedResponse]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                entry = CachedResponse(*pickle.load(file))
+            os.utime(path)
+            return entry
+        except (OSError, EOFError, pickle.UnpicklingError, TypeError):
+            return None
+
+    def set(self, key : str, entry : CachedResponse):
+        if len(entry.body) > self.max_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(tuple(entry), file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return
+        self._evict()
+
+    def _evict(self):
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        size = sum(file_size for _, file_size, _ in files)
+        files.sort()
+        while files and (len(files) > self.max_entries or size > self.max_bytes):
+            _, file_size, path = files.pop(0)
+            size -= file_size
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def delete(self, key : str):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.unlink(os.path.join(self.directory, name))
+
+
+# endpoint -> dependencies of the HTML it renders, from its view args
+endpoints = {
+    'main.index': lambda args: ('posts',),
+    'main.about': lambda args: (),
+    'main.post': lambda args: ('post:' + args['slug'],),
+    'main.comments': lambda args: ('post:' + args['slug'],),
+    'main.tag': lambda args: ('tag:' + args['tagname'],),
+    'main.category': lambda args: ('category:' + args['categoryname'],),
+    'main.user': lambda args: ('user:' + args['username'],),
+    'main.search': lambda args: ('posts',),
+}
+
+# the query args pages read; any other is left out of the key, so it cannot
+# be used to fill the cache with copies of one page
+CACHE_ARGS = ('page', 'before', 'after', 'q')
+
+
+class PageCache:
+    """Whole-response cache for anonymous GET requests on the `main` pages.
+
+    The key is the endpoint, its view args, the `CACHE_ARGS` present and
+    whether `HX-Request` was sent. Full pages also depend on `layout` (the
+    widget sidebar); every entry depends on `all`.
+
+    Each dependency is a stamp of `page_stamps`, and entries keep the tokens
+    they were rendered under, so other workers drop them within
+    `CACHE_CHECK_INTERVAL` of a change.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = app.config['PAGE_CACHE']
+        if not kind or app.debug:
+            return
+
+        if kind == 'file':
+            self.backend = FileBackend(app.config['PAGE_CACHE_DIR'],
+                                       app.config['PAGE_CACHE_MAX_ENTRIES'],
+                                       app.config['PAGE_CACHE_MAX_BYTES'])
+        elif kind == 'memory':
+            self.backend = MemoryBackend(app.config['PAGE_CACHE_MAX_ENTRIES'],
+                                         app.config['PAGE_CACHE_MAX_BYTES'])
+        else:
+            raise ValueError('Unknown PAGE_CACHE backend: {}'.format(kind))
+
+        app.before_request(self._lookup)
+        app.after_request(self._store)
+
+    def invalidate(self, names):
+        if self.backend is not None:
+            for name in names:
+                page_stamps[name].bump()
+
+    def clear(self):
+        self.invalidate(('all',))
+        if self.backend is not None:
+            self.backend.clear()
+
+    def _lookup(self):
+        if request.method != 'GET' or request.endpoint not in endpoints \
+                or current_user.is_authenticated:
+            return None
+
+        hx = request.headers.get('HX-Request') == 'true'
+        names = ('all',) + endpoints[request.endpoint](request.view_args)
+        if not hx:
+            names += ('layout',)
+
+        args = urlencode([(name, request.args[name]) for name in CACHE_ARGS if name in request.args])
+        key = '{}|{}|{}|hx={:d}'.format(request.endpoint, sorted(request.view_args.items()), args, hx)
+        versions = tuple(page_stamps[name].token for name in names)
+        entry = self.backend.get(key)
+        hit = entry is not None and entry.versions == versions
+        cache_lookup('page', hit)
+        if hit:
+            response = current_app.response_class(entry.body, entry.status, entry.headers)
+            response.headers['X-Cache'] = 'HIT'
+            return response.make_conditional(request)
+
+        # versions are taken before the view queries anything, so a write
+        # committed while rendering leaves the stored entry already stale
+        g.page_cache = (key, versions)
+        return None
+
+    def _store(self, response):
+        pending = g.pop('page_cache', None)
+        if pending is None:
+            return response
+
+        response.vary.add('HX-Request')
+        response.headers['X-Cache'] = 'MISS'
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed \
+                or session.modified or 'Set-Cookie' in response.headers:
+            return response
+
+        key, versions = pending
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name not in ('Content-Length', 'X-Cache')]
+        self.backend.set(key, CachedResponse(versions, response.status_code,
+                                             headers, response.get_data()))
+        return response
+
+
+pagecache = PageCache()
+
+
+## Invalidation
+# Changes mark the dependencies they touch, which are bumped once the session
+# commits. Posts carry the names of their author, category and tags, so
+# their pages are found without joins.
+
+def _mark(session, names):
+    if pagecache.backend is not None and session is not None:
+        mark_changed(session, *(page_stamps[name] for name in names))
+
+def _history(target, attr):
+    return sa.inspect(target).attrs[attr].history.deleted or ()
+
+def _card_names(slug, category_name, author_username, tag_names) -> set[str]:
+    names = { 'posts' }
+    if slug:
+        names.add('post:' + slug)
+    if category_name:
+        names.add('category:' + category_name)
+    if author_username:
+        names.add('user:' + author_username)
+    names.update('tag:' + tagname for tagname in tag_names or ())
+    return names
+
+def _posts_names(connection, post_ids) -> set[str]:
+    """Dependencies of the pages showing posts `post_ids`, in one SELECT."""
+    post_ids = { post_id for post_id in post_ids if post_id is not None }
+    if not post_ids:
+        return set()
+    post = Post.__table__
+    names = set()
+    for row in connection.execute(
+            sa.select(post.c.slug, post.c.category_name, post.c.author_username, post.c.tag_names)
+            .where(post.c.id.in_(post_ids))):
+        names |= _card_names(*row)
+    return names
+
+@event.listens_for(Post, 'after_insert')
+@event.listens_for(Post, 'after_update')
+@event.listens_for(Post, 'after_delete')
+def _post_changed(mapper, connection, target):
+    state = sa.inspect(target)
+    keys = ('slug', 'category_name', 'author_username', 'tag_names')
+    if state.deleted or all(key in state.dict for key in keys):
+        names = _card_names(*(state.dict.get(key) for key in keys))
+    else:
+        # tag_names is expired once cards rewrite it
+        names = _posts_names(connection, (target.id,))
+    for key, prefix in (('slug', 'post:'), ('category_name', 'category:'),
+                        ('author_username', 'user:')):
+        names.update(prefix + value for value in _history(target, key) if value)
+    _mark(so.object_session(target), names)
+
+@event.listens_for(Post.tags, 'append')
+@event.listens_for(Post.tags, 'remove')
+def _post_tags_changed(target, value, initiator):
+    session = so.object_session(target) or so.object_session(value)
+    if session is not None:
+        # `value` may be expired; loading it must not flush a pending post
+        # halfway through the append, or the post_tags row is written twice
+        with session.no_autoflush:
+            _mark(session, ('layout', 'tag:' + value.tag))
+
+@event.listens_for(Comment, 'after_insert')
+def _comment_added(mapper, connection, target):
+    # new comments wait for moderation and show up nowhere until then
+    if target.approved and not target.blocked:
+        _mark(so.object_session(target), _posts_names(connection, (target.post_id,)))
+
+@event.listens_for(Comment, 'after_update')
+@event.listens_for(Comment, 'after_delete')
+def _comment_changed(mapper, connection, target):
+    _mark(so.object_session(target),
+          _posts_names(connection, (target.post_id, *_history(target, 'post_id'))))
+
+@comments_changed.connect
+def _comments_moderated(sender, session, post_ids):
+    _mark(session, _posts_names(session.connection(), post_ids))
+
+@event.listens_for(Tag, 'after_update')
+@event.listens_for(Tag, 'after_delete')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def _label_changed(mapper, connection, target):
+    # renaming or dropping a label shows up on cards everywhere; tagging a
+    # post also flushes the Tag through the backref, without a rename
+    state = sa.inspect(target)
+    label = 'tag' if isinstance(target, Tag) else 'category'
+    if state.deleted or state.was_deleted or state.attrs[label].history.has_changes():
+        _mark(so.object_session(target), ('all', 'layout'))
+
+@event.listens_for(Tag, 'after_insert')
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Widget, 'after_insert')
+@event.listens_for(Widget, 'after_update')
+@event.listens_for(Widget, 'after_delete')
+def _layout_changed(mapper, connection, target):
+    _mark(so.object_session(target), ('layout',))
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    state = sa.inspect(target)
+    if not any(state.attrs[attr].history.has_changes()
+               for attr in ('username', 'fullname', 'email', 'about_me', 'joined')):
+        return
+    names = { 'user:' + name for name in (target.username, *_history(target, 'username')) }
+    if state.attrs.username.history.has_changes() or state.attrs.fullname.history.has_changes():
+        names.add('all')
+    _mark(so.object_session(target), names)
+
+@post_tags_changed.connect
+def _post_tags_set(post, session, tag_ids):
+    connection = session.connection()
+    names = { 'layout' } | _posts_names(connection, (post.id,))
+    names.update('tag:' + name for name in connection.scalars(
+        sa.select(Tag.__table__.c.tag).where(Tag.__table__.c.id.in_(tag_ids))))
+    _mark(session, names)
@@ -0,0 +1,179 @@
+import re
+from html import escape
+from html.parser import HTMLParser
+from typing import NamedTuple, Optional
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from markupsafe import Markup
+
+from app import db
+from app.cache import search_version
+from app.models import Post
+
+# Full-text index over posts, kept in an SQLite FTS5 virtual table whose
+# rowid is the post id. Other databases get no index and search falls back
+# to matching titles.
+
+FTS_TABLE = 'post_fts'
+CREATE_FTS = "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts " \
+             "USING fts5(title, resume, body, tokenize='porter unicode61')"
+# bm25 weights for title, resume, body
+RANK = 'bm25(post_fts, 10.0, 4.0, 1.0)'
+# snippet markers, swapped for <mark> once the text has been escaped
+_OPEN, _CLOSE = '\x02', '\x03'
+
+# engine -> (search_version token, whether the FTS table exists)
+_available = {}
+
+
+class SearchHit(NamedTuple):
+    post_id : int
+    snippet : Markup
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def html_to_text(html : Optional[str]) -> str:
+    if not html:
+        return ''
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return re.sub(r'\s+', ' ', ' '.join(parser.parts)).strip()
+
+
+def is_available(connection) -> bool:
+    """Whether the FTS table exists on this connection's database.
+
+    The answer is kept per engine until `search_version` changes, which
+    `flask search rebuild` bumps once the table is there.
+    """
+    engine = connection.engine
+    token = search_version.token
+    known = _available.get(engine)
+    if known is None or known[0] != token:
+        known = _available[engine] = (token, connection.dialect.name == 'sqlite' and
+                                      sa.inspect(connection).has_table(FTS_TABLE))
+    return known[1]
+
+
+def to_match(query : str) -> Optional[str]:
+    """Turn reader input into a safe FTS5 query: every word must match,
+    the last one as a prefix."""
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    terms = ['"{}"'.format(word) for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search(query : str, page : int, per_page : int) -> tuple[list[SearchHit], bool]:
+    """Ranked hits for one page and whether there is a next page.
+
+    Ranking and paging happen inside the FTS index; the post table is only
+    read afterwards, by primary key, for the hits on the page.
+    """
+    match = to_match(query)
+    if match is None:
+        return [], False
+
+    connection = db.session.connection()
+    if is_available(connection):
+        rows = db.session.execute(
+            sa.text('SELECT rowid, snippet(post_fts, -1, :open, :close, \'…\', 24) '
+                    'FROM post_fts WHERE post_fts MATCH :match '
+                    'ORDER BY {} LIMIT :limit OFFSET :offset'.format(RANK)),
+            { 'open': _OPEN, 'close': _CLOSE, 'match': match,
+              'limit': per_page + 1, 'offset': (page - 1) * per_page }
+        ).all()
+    else:
+        words = re.findall(r'\w+', query)
+        rows = db.session.execute(
+            sa.select(Post.id, Post.title)
+            .where(*[Post.title.ilike('%{}%'.format(word)) for word in words])
+            .order_by(Post.timestamp.desc(), Post.id.desc())
+            .limit(per_page + 1).offset((page - 1) * per_page)
+        ).all()
+
+    hits = [SearchHit(post_id, _highlight(snippet)) for post_id, snippet in rows[:per_page]]
+    return hits, len(rows) > per_page
+
+
+def _highlight(snippet : str) -> Markup:
+    return Markup(escape(snippet).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>'))
+
+
+## Index maintenance
+
+def _values(post_id, title, resume, body) -> dict:
+    return { 'id': post_id, 'title': title or '', 'resume': html_to_text(resume),
+             'body': html_to_text(body) }
+
+def index_rows(connection, rows):
+    """(id, title, resume, body) rows -> replace their index entries."""
+    rows = [_values(*row) for row in rows]
+    if not rows:
+        return
+    connection.execute(sa.text('DELETE FROM post_fts WHERE rowid = :id'), rows)
+    connection.execute(sa.text('INSERT INTO post_fts (rowid, title, resume, body) '
+                               'VALUES (:id, :title, :resume, :body)'), rows)
+
+def rebuild(connection, chunk : int = 500) -> int:
+    """Recreate the index from the post table. Returns the number of posts."""
+    if connection.dialect.name != 'sqlite':
+        return 0
+    connection.execute(sa.text('DROP TABLE IF EXISTS post_fts'))
+    connection.execute(sa.text(CREATE_FTS))
+    # read binds may have cached the table as missing; other workers
+    # look again when search_version is bumped after the commit
+    _available.clear()
+
+    post = Post.__table__
+    result = connection.execute(
+        sa.select(post.c.id, post.c.title, post.c.resume, post.c.body)
+        .execution_options(yield_per=chunk)
+    )
+    count = 0
+    for rows in result.partitions():
+        index_rows(connection, rows)
+        count += len(rows)
+    return count
+
+
+@event.listens_for(Post, 'after_insert')
+def _index_post(mapper, connection, target):
+    if is_available(connection):
+        index_rows(connection, [(target.id, target.title, target.resume, target.body)])
+
+@event.listens_for(Post, 'after_update')
+def _reindex_post(mapper, connection, target):
+    if not is_available(connection):
+        return
+
+    state = sa.inspect(target)
+    changed = [column for column in ('title', 'resume', 'body')
+               if state.attrs[column].history.has_changes()]
+    if not changed:
+        return
+
+    values = _values(target.id, *[getattr(target, column) if column in changed else None
+                                  for column in ('title', 'resume', 'body')])
+    connection.execute(
+        sa.text('UPDATE post_fts SET {} WHERE rowid = :id'.format(
+            ', '.join('{0} = :{0}'.format(column) for column in changed))),
+        values
+    )
+
+@event.listens_for(Post, 'after_delete')
+def _unindex_post(mapper, connection, target):
+    if is_available(connection):
+        connection.execute(sa.text('DELETE FROM post_fts WHERE rowid = :id'), { 'id': target.id })
@@ -0,0 +1,72 @@
+import zlib
+from typing import Iterator
+
+from flask import current_app, request, g, render_template, stream_template
+
+from app import htmx
+
+
+def _wants_stream() -> bool:
+    config = current_app.config
+    if not config['STREAM_PAGES'] or (htmx and not config['STREAM_HTMX']):
+        return False
+    # the page cache keeps whole bodies, so pages it will store are rendered as usual
+    return g.get('page_cache') is None
+
+
+def _gzip(chunks : Iterator[bytes], level : int) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        # sync-flush each chunk so the browser can start on the <head> early
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def _rechunk(parts : Iterator[str], size : int) -> Iterator[bytes]:
+    buffer, length = [], 0
+    for part in parts:
+        data = part.encode()
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def render_page(template : str, **context):
+    """Render `template` as a streamed response, gzipped on the fly when the
+    client accepts it.
+
+    Output is sent in `STREAM_CHUNK_SIZE` pieces, so neither the page nor its
+    compressed form is ever held whole. Pages that end before
+    `STREAM_MIN_SIZE` bytes are sent plain, in one piece.
+    """
+    if not _wants_stream():
+        return render_template(template, **context)
+
+    config = current_app.config
+    chunks = _rechunk(stream_template(template, **context), config['STREAM_CHUNK_SIZE'])
+    head = []
+    for chunk in chunks:
+        head.append(chunk)
+        if sum(map(len, head)) >= config['STREAM_MIN_SIZE']:
+            break
+    else:
+        response = current_app.response_class(b''.join(head), mimetype='text/html')
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def body():
+        yield from head
+        yield from chunks
+
+    gzipped = 'gzip' in request.accept_encodings
+    response = current_app.response_class(
+        _gzip(body(), config['STREAM_GZIP_LEVEL']) if gzipped else body(),
+        mimetype='text/html')
+    if gzipped:
+        response.content_encoding = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
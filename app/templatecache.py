@@ -0,0 +1,95 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from app.cache import cards_version
+from app.metrics import cache_lookup
+
+# `{% cache value, ... %}...{% endcache %}` keeps the rendered block in memory,
+# keyed by the block and the values: pass everything its output depends on,
+# and keep the current user out of it (and out of anything it includes).
+#
+#     {% cache post.id, post.last_modified, post.comment_count, cards_version.token %}
+#         ...
+#     {% endcache %}
+
+
+class TemplateCache:
+    """Rendered template blocks, LRU bounded by entry count and total size.
+
+    A `max_entries` of 0 turns it off.
+    """
+
+    def __init__(self):
+        self.max_entries = 0
+        self.max_bytes = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_entries = app.config['TEMPLATE_CACHE_MAX_ENTRIES']
+        self.max_bytes = app.config['TEMPLATE_CACHE_MAX_BYTES']
+        self.clear()
+        app.jinja_env.add_extension(CacheExtension)
+        app.jinja_env.globals['cards_version'] = cards_version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get(self, key : tuple, render) -> Markup:
+        if not self.max_entries:
+            return Markup(render())
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+        cache_lookup('template', html is not None)
+        if html is not None:
+            return html
+
+        html = Markup(render())
+        if len(html) > self.max_bytes:
+            return html
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = html
+            self._size += len(html)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return html
+
+
+template_cache = TemplateCache()
+
+# tells compilations apart, so a template reloaded after an edit does not
+# find the blocks of its old version
+_compiled = itertools.count()
+
+
+class CacheExtension(Extension):
+    tags = { 'cache' }
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        values = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            values.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+
+        block = nodes.Const((parser.name, lineno, next(_compiled)))
+        values = nodes.Tuple(values, 'load')
+        return nodes.CallBlock(self.call_method('_cached', [block, values]), [], [], body).set_lineno(lineno)
+
+    def _cached(self, block : tuple, values : tuple, caller) -> Markup:
+        # values are made hashable through their repr, lists included
+        return template_cache.get(block + (repr(values),), caller)
@@ -0,0 +1,39 @@
+import threading
+
+from markupsafe import Markup
+
+from app.cache import VersionStamp
+from app.metrics import cache_lookup
+
+
+class FragmentCache:
+    """Rendered widget HTML, one entry per widget.
+
+    An entry is reused while the tokens of the stamps it was rendered under
+    are unchanged.
+    """
+
+    def __init__(self):
+        self._fragments = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+    def get(self, name : str, stamps : tuple[VersionStamp, ...], render) -> Markup:
+        token = tuple(stamp.token for stamp in stamps)
+        cached = self._fragments.get(name)
+        if cached is not None and cached[0] == token:
+            cache_lookup('widget', True)
+            return cached[1]
+
+        cache_lookup('widget', False)
+
+        html = Markup(render())
+        with self._lock:
+            self._fragments[name] = (token, html)
+        return html
+
+
+fragments = FragmentCache()
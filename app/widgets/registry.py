@@ -0,0 +1,62 @@
+import time
+import threading
+from typing import NamedTuple
+
+import sqlalchemy as sa
+
+from app import db
+from app.cache import VersionStamp, widgets_version
+from app.models import Widget
+
+
+class WidgetEntry(NamedTuple):
+    name : str
+    location : str
+    order : int
+    lazy : bool
+
+
+class WidgetRegistry:
+    """Process-wide copy of the active widgets, read by the layout.
+
+    Reloaded when `widgets_version` moves (any worker committed a `Widget`
+    change) or after `WIDGET_CACHE_TTL` seconds, whichever comes first.
+    """
+
+    def __init__(self, stamp : VersionStamp):
+        self.stamp = stamp
+        self.ttl = 300
+        self._entries = None
+        self._token = None
+        self._loaded = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config['WIDGET_CACHE_TTL']
+        self.clear()
+
+    def clear(self):
+        self._entries = None
+
+    def active(self) -> tuple[WidgetEntry, ...]:
+        token = self.stamp.token
+        if self._entries is None or token != self._token \
+                or time.monotonic() - self._loaded >= self.ttl:
+            with self._lock:
+                if self._entries is None or token != self._token \
+                        or time.monotonic() - self._loaded >= self.ttl:
+                    self._load(token)
+        return self._entries
+
+    def _load(self, token : int):
+        rows = db.session.execute(
+            sa.select(Widget.name, Widget.location, Widget.order, Widget.lazy)
+            .where(Widget.is_active == True)
+            .order_by(Widget.order.asc())
+        )
+        self._entries = tuple(WidgetEntry(*row) for row in rows)
+        self._token = token
+        self._loaded = time.monotonic()
+
+
+registry = WidgetRegistry(widgets_version)
@@ -1,39 +1,73 @@
 import sqlalchemy as sa
-from flask import render_template, redirect, url_for, request
+from flask import render_template, redirect, url_for, current_app
 
 from app import db, htmx
+from app.cache import widgets_version, categories_version, tags_version, posts_version
 from app.models import SocialNetwork, Widget, Category, Tag
 from app.widgets import bp
+from app.widgets.fragments import fragments
 
-@bp.route('/about')
-def about():
-    if not htmx:
-        return redirect('main.index')
+## Renderers
 
+def _about():
     info = db.session.scalar(
         sa.select(Widget).where(Widget.name == 'about')
     )
 
     return render_template('partials/about.html', info=info)
 
-@bp.route('/categories')
-def categories():
-    if not htmx:
-        return redirect('main.index')
-
+def _categories():
     categories = db.session.scalars(
         sa.select(Category).order_by(Category.category.asc())
     )
 
     return render_template('partials/categories.html', categories=categories)
 
-@bp.route('/tags')
-def tags():
-    if not htmx:
-        return redirect('main.index')
-    
+def _tags():
     tags = db.session.scalars(
         sa.select(Tag).order_by(Tag.tag.asc())
     )
 
     return render_template('partials/tags.html', tags=tags)
+
+# endpoint -> (renderer, stamps the rendered fragment depends on)
+renderers = {
+    'widgets.about': (_about, (widgets_version,)),
+    'widgets.categories': (_categories, (categories_version,)),
+    'widgets.tags': (_tags, (tags_version, posts_version)),
+}
+
+def render_widget(location : str):
+    render, stamps = renderers[location]
+    return fragments.get(location, stamps, render)
+
+def inline_widget(widget):
+    """Cached HTML for `widget`, or None when it should load through HTMX."""
+    if not current_app.config['WIDGETS_INLINE'] or widget.lazy \
+            or widget.location not in renderers:
+        return None
+
+    return render_widget(widget.location)
+
+## Routes
+
+@bp.route('/about')
+def about():
+    if not htmx:
+        return redirect(url_for('main.index'))
+
+    return render_widget('widgets.about')
+
+@bp.route('/categories')
+def categories():
+    if not htmx:
+        return redirect(url_for('main.index'))
+
+    return render_widget('widgets.categories')
+
+@bp.route('/tags')
+def tags():
+    if not htmx:
+        return redirect(url_for('main.index'))
+
+    return render_widget('widgets.tags')
@@ -0,0 +1,6 @@
+"""Benchmarks: a seeded corpus generator and a route timer.
+
+    python -m bench corpus bench.db --posts 5000
+    python -m bench run bench.db -o before.json
+    python -m bench run bench.db -b before.json
+"""
@@ -0,0 +1,74 @@
+import os
+
+import click
+
+from config import Config
+from bench import corpus, runner
+
+
+def make_app(database : str, **settings):
+    from app import create_app, db
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.abspath(database)
+        CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(database)), 'bench-cache')
+        # no log files in the checkout
+        LOG_TO_STDOUT = True
+
+    for key, value in settings.items():
+        setattr(BenchConfig, key, value)
+    return create_app(BenchConfig), db
+
+
+@click.group()
+def cli():
+    """Flask CMS benchmarks"""
+    pass
+
+
+@cli.command('corpus')
+@click.argument('database')
+@click.option('--users', default=20, show_default=True)
+@click.option('--categories', default=8, show_default=True)
+@click.option('--tags', default=60, show_default=True)
+@click.option('--posts', default=1000, show_default=True)
+@click.option('--comments', default=20000, show_default=True)
+@click.option('--seed', default=1, show_default=True)
+def make_corpus(database, users, categories, tags, posts, comments, seed):
+    """Create DATABASE and fill it with a synthetic corpus"""
+    if os.path.exists(database):
+        raise click.ClickException('{} already exists'.format(database))
+
+    app, db = make_app(database)
+    with app.app_context():
+        db.create_all()
+        corpus.generate(corpus.CorpusSize(users, categories, tags, posts, comments), seed)
+    click.echo('Corpus written to {}'.format(database))
+
+
+@cli.command('run')
+@click.argument('database')
+@click.option('-n', '--requests', default=200, show_default=True, help='Timed requests per route and mode')
+@click.option('--warmup', default=20, show_default=True)
+@click.option('--seed', default=1, show_default=True)
+@click.option('--page-cache', default='', help='PAGE_CACHE backend to run with (default: off)')
+@click.option('--per-page', type=int, help='PER_PAGE to run with')
+@click.option('-o', '--output', help='Save the results as JSON')
+@click.option('-b', '--baseline', help='Compare with results saved earlier')
+def run(database, requests, warmup, seed, page_cache, per_page, output, baseline):
+    """Time every route against DATABASE"""
+    if not os.path.exists(database):
+        raise click.ClickException('{} not found, create it with `corpus`'.format(database))
+
+    settings = { 'PAGE_CACHE': page_cache }
+    if per_page:
+        settings['PER_PAGE'] = per_page
+    app, db = make_app(database, **settings)
+
+    results = runner.run(app, requests=requests, warmup=warmup, seed=seed)
+    click.echo(runner.format_table(results, runner.load(baseline) if baseline else None))
+    if output:
+        runner.save(results, output)
+
+
+cli(prog_name='python -m bench')
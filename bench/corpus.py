@@ -0,0 +1,127 @@
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from app import db, search, cards
+from app.models import User, Post, Category, Tag, Widget, Comment, post_tags, \
+    recount_tags, recount_comments
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+    'incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud '
+    'exercitation ullamco laboris nisi aliquip ex ea commodo consequat duis aute irure '
+    'in reprehenderit voluptate velit esse cillum fugiat nulla pariatur excepteur sint '
+    'occaecat cupidatat non proident sunt culpa qui officia deserunt mollit anim id est '
+    'flask python htmx sqlite cache query template index cursor widget'
+).split()
+
+START = datetime(2022, 1, 1)
+
+
+@dataclass
+class CorpusSize:
+    users : int = 20
+    categories : int = 8
+    tags : int = 60
+    posts : int = 1000
+    comments : int = 20000
+
+
+def _zipf_weights(n : int, s : float = 1.1) -> list[float]:
+    """A few items get most of the picks, like authors, tags and categories do."""
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def _sentence(rng : random.Random, words : int) -> str:
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def _body(rng : random.Random) -> str:
+    # post length is roughly log-normal: mostly short, a long tail of essays
+    words = int(min(8000, max(80, rng.lognormvariate(6.2, 0.7))))
+    paragraphs = []
+    while words > 0:
+        size = min(words, rng.randint(40, 160))
+        paragraphs.append('<p>{}</p>'.format(
+            ' '.join(_sentence(rng, rng.randint(8, 20)) for _ in range(max(1, size // 14)))))
+        words -= size
+    return '\n'.join(paragraphs)
+
+
+def generate(size : CorpusSize, seed : int = 1, batch : int = 500):
+    """Fill the (empty) database of the current app. Same seed, same corpus."""
+    rng = random.Random(seed)
+
+    users = [User(username='user{}'.format(i), fullname='User {}'.format(i),
+                  email='user{}@example.com'.format(i), about_me=_sentence(rng, 20),
+                  joined=START) for i in range(size.users)]
+    for user in users:
+        user.set_password('bench')
+    categories = [Category(category='category-{}'.format(i)) for i in range(size.categories)]
+    tags = [Tag(tag='tag-{}'.format(i)) for i in range(size.tags)]
+    db.session.add_all(users + categories + tags)
+    db.session.add_all([
+        Widget(name='about', location='widgets.about', order=1, is_active=True,
+               additional_data=_sentence(rng, 40)),
+        Widget(name='categories', location='widgets.categories', order=2, is_active=True),
+        Widget(name='tags', location='widgets.tags', order=3, is_active=True),
+    ])
+    db.session.flush()
+
+    author_weights = _zipf_weights(size.users)
+    category_weights = _zipf_weights(size.categories)
+    tag_weights = _zipf_weights(size.tags)
+    user_ids = [user.id for user in users]
+    category_ids = [category.id for category in categories]
+    tag_ids = [tag.id for tag in tags]
+
+    # posts arrive at a steady rate with random gaps over the corpus' lifetime
+    timestamp = START
+    post_ids = []
+    for start in range(0, size.posts, batch):
+        rows = []
+        for number in range(start, min(start + batch, size.posts)):
+            timestamp += timedelta(minutes=rng.expovariate(1 / (60 * 18)))
+            rows.append({
+                'slug': 'post-{}'.format(number),
+                'title': _sentence(rng, rng.randint(3, 9))[:-1],
+                'body': _body(rng),
+                'timestamp': timestamp,
+                'last_modified': timestamp,
+                'user_id': rng.choices(user_ids, author_weights)[0],
+                'category_id': rng.choices(category_ids, category_weights)[0],
+            })
+        post_ids += db.session.scalars(sa.insert(Post).returning(Post.id), rows).all()
+
+        pairs = set()
+        for post_id in post_ids[start:]:
+            for tag_id in rng.choices(tag_ids, tag_weights, k=rng.randint(0, 6)):
+                pairs.add((post_id, tag_id))
+        if pairs:
+            db.session.execute(sa.insert(post_tags),
+                               [{ 'post_id': post_id, 'tag_id': tag_id } for post_id, tag_id in pairs])
+
+    # comments pile up on a few popular posts; one in ten waits for moderation
+    post_weights = _zipf_weights(len(post_ids), 0.9)
+    rng.shuffle(post_weights)
+    for start in range(0, size.comments, batch * 4):
+        db.session.execute(sa.insert(Comment), [{
+            'post_id': post_id,
+            'user_id': rng.choices(user_ids, author_weights)[0],
+            'body': _sentence(rng, rng.randint(4, 40))[:512],
+            'timestamp': START + timedelta(minutes=rng.randint(0, 60 * 24 * 900)),
+            'approved': rng.random() > 0.1,
+            'blocked': False,
+        } for post_id in rng.choices(post_ids, post_weights,
+                                     k=min(batch * 4, size.comments - start))])
+
+    connection = db.session.connection()
+    recount_tags(connection)
+    recount_comments(connection)
+    # bulk inserts skip the mapper events that fill in the cards
+    cards.rebuild(connection)
+    search.rebuild(connection)
+    db.session.commit()
@@ -0,0 +1,181 @@
+import gc
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from app import db
+from app.models import User, Post, Category, Tag, Widget
+
+HX = { 'HX-Request': 'true' }
+
+
+@dataclass
+class RouteResult:
+    route : str
+    mode : str
+    requests : int
+    p50_ms : float
+    p90_ms : float
+    p99_ms : float
+    mean_ms : float
+    queries : float
+    max_queries : int
+    peak_kb : float
+
+    @property
+    def key(self) -> str:
+        return '{} [{}]'.format(self.route, self.mode)
+
+
+def _percentile(samples : list[float], percent : float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def targets(rng : random.Random, sample : int = 50) -> dict[str, list[str]]:
+    """URLs to hit per route, drawn from what is in the database."""
+    def pick(column):
+        values = db.session.scalars(sa.select(column)).all()
+        return rng.sample(values, min(sample, len(values))) if values else []
+
+    widgets = db.session.scalars(
+        sa.select(Widget.location).where(Widget.is_active == True).order_by(Widget.order)
+    ).all()
+    routes = {
+        'index': ['/'],
+        'post': ['/post/{}'.format(slug) for slug in pick(Post.slug)],
+        'tag': ['/tag/{}'.format(name) for name in pick(Tag.tag)],
+        'category': ['/category/{}'.format(name) for name in pick(Category.category)],
+        'user': ['/user/{}'.format(name) for name in pick(User.username)],
+    }
+    for location in widgets:
+        routes[location] = ['/widgets/{}'.format(location.split('.', 1)[1])]
+    return routes
+
+
+class StatementCounter:
+    def __init__(self, engines):
+        self.engines = list(engines)
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self._count)
+
+
+def run(app, requests : int = 200, warmup : int = 20, seed : int = 1) -> list[RouteResult]:
+    """Time every route in full-page and HTMX mode through the test client.
+
+    Widget routes only answer HTMX requests, so they are run in that mode only.
+    """
+    rng = random.Random(seed)
+    with app.app_context():
+        routes = targets(rng)
+        engines = set(db.engines.values())
+
+    client = app.test_client()
+    results = []
+    for route, urls in routes.items():
+        if not urls:
+            continue
+        modes = ('hx',) if route.startswith('widgets.') else ('full', 'hx')
+        for mode in modes:
+            headers = HX if mode == 'hx' else {}
+
+            def fetch(url):
+                response = client.get(url, headers=headers)
+                response.get_data()
+                response.close()
+                return response.status_code
+
+            for number in range(warmup):
+                fetch(urls[number % len(urls)])
+
+            timings, queries = [], []
+            with StatementCounter(engines) as counter:
+                for number in range(requests):
+                    url = urls[number % len(urls)]
+                    before = counter.count
+                    started = time.perf_counter()
+                    status = fetch(url)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    queries.append(counter.count - before)
+                    if status != 200:
+                        raise RuntimeError('{} answered {}'.format(url, status))
+
+            # memory is measured on a separate pass, tracemalloc slows everything down
+            gc.collect()
+            tracemalloc.start()
+            peak = 0
+            for url in urls[:10]:
+                tracemalloc.reset_peak()
+                fetch(url)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+            results.append(RouteResult(
+                route=route, mode=mode, requests=requests,
+                p50_ms=round(_percentile(timings, 50), 3),
+                p90_ms=round(_percentile(timings, 90), 3),
+                p99_ms=round(_percentile(timings, 99), 3),
+                mean_ms=round(statistics.fmean(timings), 3),
+                queries=round(statistics.fmean(queries), 2),
+                max_queries=max(queries),
+                peak_kb=round(peak / 1024, 1),
+            ))
+    return results
+
+
+## Reports
+
+def save(results : list[RouteResult], path : str):
+    with open(path, 'w') as file:
+        json.dump([asdict(result) for result in results], file, indent=2)
+
+
+def load(path : str) -> dict[str, RouteResult]:
+    with open(path) as file:
+        results = [RouteResult(**row) for row in json.load(file)]
+    return { result.key: result for result in results }
+
+
+def _delta(now : float, then : float) -> str:
+    if not then:
+        return ''
+    return '{:+.0f}%'.format((now - then) / then * 100)
+
+
+def format_table(results : list[RouteResult], baseline : dict[str, RouteResult] = None) -> str:
+    header = ['route', 'p50 ms', 'p90 ms', 'p99 ms', 'queries', 'peak KB']
+    if baseline:
+        header += ['Δ p50', 'Δ p90', 'Δ queries']
+    rows = [header]
+    for result in results:
+        row = [result.key, '{:.2f}'.format(result.p50_ms), '{:.2f}'.format(result.p90_ms),
+               '{:.2f}'.format(result.p99_ms), '{:g}'.format(result.queries),
+               '{:.0f}'.format(result.peak_kb)]
+        if baseline:
+            then = baseline.get(result.key)
+            row += [_delta(result.p50_ms, then.p50_ms), _delta(result.p90_ms, then.p90_ms),
+                    _delta(result.queries, then.queries)] if then else ['new', '', '']
+        rows.append(row)
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width) if column == 0 else cell.rjust(width)
+                               for column, (cell, width) in enumerate(zip(row, widths)))
+                     for row in rows)
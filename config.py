@@ -11,5 +11,56 @@ class Config(object):
     PER_PAGE = int(os.environ.get('PER_PAGE') or 3)
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
     RESUME_LENGTH = int(os.environ.get('RESUME_LENGTH') or 100) 
+    WORDS_PER_MINUTE = int(os.environ.get('WORDS_PER_MINUTE') or 200)
     RECAPTCHA_PUBLIC_KEY = os.environ.get('RECAPTCHA_PUBLIC_KEY')
-    RECAPTCHA_PRIVATE_KEY= os.environ.get('RECAPTCHA_PRIVATE_KEY')
\ No newline at end of file
+    RECAPTCHA_PRIVATE_KEY= os.environ.get('RECAPTCHA_PRIVATE_KEY')
+    CACHE_DIR = os.environ.get('CACHE_DIR') or os.path.join(basedir, 'cache')
+    CACHE_CHECK_INTERVAL = float(os.environ.get('CACHE_CHECK_INTERVAL') or 5)
+    WIDGET_CACHE_TTL = int(os.environ.get('WIDGET_CACHE_TTL') or 300)
+    PAGE_CACHE = os.environ.get('PAGE_CACHE', 'memory')
+    PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR') or os.path.join(CACHE_DIR, 'pages')
+    PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES') or 1024)
+    PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES') or 64 * 1024 * 1024)
+    TEMPLATE_CACHE_MAX_ENTRIES = int(os.environ.get('TEMPLATE_CACHE_MAX_ENTRIES') or 4096)
+    TEMPLATE_CACHE_MAX_BYTES = int(os.environ.get('TEMPLATE_CACHE_MAX_BYTES') or 16 * 1024 * 1024)
+    WIDGETS_INLINE = (os.environ.get('WIDGETS_INLINE') or 'true').lower() in ('1', 'true', 'yes')
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE') or 500)
+    IMPORT_JOBS = int(os.environ.get('IMPORT_JOBS') or 0) or None
+    COMMENTS_PER_PAGE = int(os.environ.get('COMMENTS_PER_PAGE') or 10)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES') or 4096)
+    ACTIVITY_FLUSH_INTERVAL = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL') or 60)
+    ACTIVITY_BATCH_SIZE = int(os.environ.get('ACTIVITY_BATCH_SIZE') or 500)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 10)
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 10)
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 0)
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'wal')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'normal')
+    SQLITE_BUSY_TIMEOUT = os.environ.get('SQLITE_BUSY_TIMEOUT', '5000')
+    SQLITE_CACHE_SIZE = os.environ.get('SQLITE_CACHE_SIZE', '-32000')
+    SQLITE_MMAP_SIZE = os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))
+    SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE', 'memory')
+    SQLALCHEMY_READ_URIS = [uri for uri in (os.environ.get('READ_DATABASE_URLS') or '').split(',') if uri]
+    SQLITE_READ_ONLY_BIND = (os.environ.get('SQLITE_READ_ONLY_BIND') or 'true').lower() in ('1', 'true', 'yes')
+    ASSETS_DIR = os.environ.get('ASSETS_DIR') or os.path.join(basedir, 'assets')
+    ASSETS_MAX_AGE = int(os.environ.get('ASSETS_MAX_AGE') or 365 * 24 * 3600)
+    STREAM_PAGES = (os.environ.get('STREAM_PAGES') or 'true').lower() in ('1', 'true', 'yes')
+    STREAM_HTMX = (os.environ.get('STREAM_HTMX') or 'false').lower() in ('1', 'true', 'yes')
+    STREAM_MIN_SIZE = int(os.environ.get('STREAM_MIN_SIZE') or 1024)
+    STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE') or 8192)
+    STREAM_GZIP_LEVEL = int(os.environ.get('STREAM_GZIP_LEVEL') or 6)
+    FEED_TITLE = os.environ.get('FEED_TITLE') or 'Flask CMS'
+    FEED_LENGTH = int(os.environ.get('FEED_LENGTH') or 20)
+    FEED_MAX_AGE = int(os.environ.get('FEED_MAX_AGE') or 300)
+    FEED_CACHE_MAX_ENTRIES = int(os.environ.get('FEED_CACHE_MAX_ENTRIES') or 256)
+    SITEMAP_MAX_URLS = int(os.environ.get('SITEMAP_MAX_URLS') or 50000)
+    INSTRUMENTATION = (os.environ.get('INSTRUMENTATION') or 'false').lower() in ('1', 'true', 'yes')
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS') or 500)
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS') or 100)
+    REPEATED_QUERY_THRESHOLD = int(os.environ.get('REPEATED_QUERY_THRESHOLD') or 5)
+    METRICS = (os.environ.get('METRICS') or 'false').lower() in ('1', 'true', 'yes')
+    METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(CACHE_DIR, 'metrics')
+    METRICS_WRITE_INTERVAL = float(os.environ.get('METRICS_WRITE_INTERVAL') or 5)
+    METRICS_ALLOW = os.environ.get('METRICS_ALLOW', '127.0.0.1,::1')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
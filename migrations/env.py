@@ -94,6 +94,16 @@ def run_migrations_online():
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
 
+    # the full-text index is an FTS5 virtual table (plus its shadow tables)
+    # managed by app.search, not by the models
+    def include_name(name, type_, parent_names):
+        if type_ == 'table':
+            return not name.startswith('post_fts')
+        return True
+
+    if conf_args.get("include_name") is None:
+        conf_args["include_name"] = include_name
+
     connectable = get_engine()
 
     with connectable.connect() as connection:
@@ -0,0 +1,35 @@
+"""post full-text index
+
+Revision ID: 7f3c2e91b4ad
+Revises: e4b7a9c1d058
+Create Date: 2026-10-18 14:05:52.339871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3c2e91b4ad'
+down_revision = 'e4b7a9c1d058'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 only exists on SQLite; other databases search titles instead
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS post_fts "
+               "USING fts5(title, resume, body, tokenize='porter unicode61')")
+    # plain-text bodies are filled in by `flask search rebuild`
+    op.execute("INSERT INTO post_fts (rowid, title, resume, body) "
+               "SELECT id, title, '', '' FROM post")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("DROP TABLE IF EXISTS post_fts")
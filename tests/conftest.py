@@ -0,0 +1,112 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from config import Config
+
+
+def make_app(directory, **settings):
+    from app import create_app
+
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(directory, 'app.db')
+        CACHE_DIR = os.path.join(directory, 'cache')
+        PAGE_CACHE_DIR = os.path.join(directory, 'cache', 'pages')
+        METRICS_DIR = os.path.join(directory, 'cache', 'metrics')
+        ASSETS_DIR = os.path.join(directory, 'assets')
+        CACHE_CHECK_INTERVAL = 0
+        LOG_TO_STDOUT = True
+        PER_PAGE = 5
+
+    for key, value in settings.items():
+        setattr(TestConfig, key, value)
+    return create_app(TestConfig)
+
+
+def seed(nposts=12, ntags=4):
+    """Two users, three categories and `nposts` posts, an hour apart and
+    newest last: post-<i> has tag<i % ntags> and tag<(i + 1) % ntags> and
+    i % 4 approved comments."""
+    from app import db
+    from app.models import User, Post, Category, Tag, Widget, Comment
+
+    # read binds are the same database
+    db.create_all(bind_key=None)
+    bob = User(username='bob', fullname='Bob B', email='bob@example.com')
+    amy = User(username='amy', fullname='Amy A', email='amy@example.com')
+    categories = [Category(category='cat{}'.format(i)) for i in range(3)]
+    tags = [Tag(tag='tag{}'.format(i)) for i in range(ntags)]
+    db.session.add_all([bob, amy, *categories, *tags])
+    db.session.flush()
+
+    start = datetime(2024, 1, 1)
+    for i in range(nposts):
+        post = Post(slug='post-{}'.format(i), title='Post {}'.format(i),
+                    body='<p>hello {} world</p><p>more</p>'.format(i),
+                    author=bob if i % 2 else amy, category=categories[i % 3],
+                    timestamp=start + timedelta(hours=i), last_modified=start + timedelta(hours=i))
+        db.session.add(post)
+        db.session.flush()
+        post.add_tags([tags[i % ntags], tags[(i + 1) % ntags]])
+        for j in range(i % 4):
+            db.session.add(Comment(post=post, author=bob, body='comment {}'.format(j), approved=True))
+    db.session.add_all([
+        Widget(name='about', location='widgets.about', order=1, is_active=True, additional_data='About'),
+        Widget(name='categories', location='widgets.categories', order=2, is_active=True),
+        Widget(name='tags', location='widgets.tags', order=3, is_active=True),
+    ])
+    db.session.commit()
+
+
+class QueryLog:
+    """Statements sent to the app's engine."""
+
+    def __init__(self, engine):
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute', self._executed)
+
+    def _executed(self, connection, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def clear(self):
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def app(tmp_path, request):
+    """A seeded app; `@pytest.mark.settings(NAME=value)` overrides config."""
+    marker = request.node.get_closest_marker('settings')
+    app = make_app(str(tmp_path), **(marker.kwargs if marker else {}))
+    with app.app_context():
+        seed()
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def queries(app):
+    from app import db
+    with app.app_context():
+        return QueryLog(db.engine)
+
+@pytest.fixture
+def runner(app):
+    return app.test_cli_runner()
+
+
+@pytest.fixture
+def login(client):
+    def login(user_id : int):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+    return login
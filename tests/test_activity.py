@@ -0,0 +1,57 @@
+import time
+from datetime import datetime
+
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import User
+from app.activity import last_seen
+from app.cache import users_version
+
+pytestmark = pytest.mark.settings(PAGE_CACHE='')
+
+
+def seen_at(user_id : int):
+    return db.session.scalar(sa.select(User.last_seen).where(User.id == user_id))
+
+
+@pytest.mark.settings(PAGE_CACHE='', ACTIVITY_FLUSH_INTERVAL=1000, ACTIVITY_BATCH_SIZE=2)
+def test_requests_only_buffer(app, client, queries, login):
+    token = users_version.token
+    login(1)
+    queries.clear()
+    client.get('/about')
+    assert last_seen.pending == 1
+    assert not any(statement.startswith('UPDATE') for statement in queries.statements)
+
+    last_seen.seen(2)
+    client.get('/about')
+    assert last_seen.pending == 0
+    assert users_version.token == token
+
+
+@pytest.mark.settings(PAGE_CACHE='', ACTIVITY_FLUSH_INTERVAL=0.2)
+def test_buffer_is_flushed_without_traffic(app, client, login):
+    login(1)
+    with app.app_context():
+        before = seen_at(1)
+        last_seen.flush()
+    client.get('/about')
+    assert last_seen.pending == 1
+    deadline = time.monotonic() + 5
+    while last_seen.pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert last_seen.pending == 0
+    with app.app_context():
+        assert seen_at(1) != before
+
+
+def test_older_times_do_not_win(app):
+    with app.app_context():
+        last_seen.seen(1)
+        last_seen.flush()
+        latest = seen_at(1)
+        last_seen.seen(1, datetime(2000, 1, 1))
+        last_seen.flush()
+        assert seen_at(1) == latest
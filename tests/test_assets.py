@@ -0,0 +1,54 @@
+import os
+import re
+import gzip
+import json
+
+import pytest
+
+from app.assets import assets, build, fingerprint
+
+pytestmark = pytest.mark.settings(PAGE_CACHE='')
+
+
+def stylesheets(client) -> list[str]:
+    return [url.decode() for url in re.findall(rb'href="(/static/css/[^"]+)"', client.get('/').data)]
+
+
+def test_fingerprint():
+    assert re.fullmatch(r'css/style\.[0-9a-f]{12}\.css', fingerprint('css/style.css', b'body {}'))
+    assert fingerprint('a.css', b'x') != fingerprint('a.css', b'y')
+
+
+def test_build_writes_hashed_and_gzipped_copies(tmp_path):
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    (static / 'css' / 'style.css').write_text('body { color: red; }\n' * 50)
+    (static / 'logo.png').write_bytes(b'\x89PNG' + bytes(64))
+
+    manifest, compressed = build(str(static), str(tmp_path / 'out'))
+    assert set(manifest) == { 'css/style.css', 'logo.png' } and compressed == 1
+    assert os.path.exists(tmp_path / 'out' / (manifest['css/style.css'] + '.gz'))
+    assert not os.path.exists(tmp_path / 'out' / (manifest['logo.png'] + '.gz'))
+    assert json.loads((tmp_path / 'out' / 'manifest.json').read_text()) == manifest
+
+
+def test_built_files_are_served_for_good(app, client, runner):
+    assert stylesheets(client) == ['/static/css/pico.min.css', '/static/css/style.css']
+    assert 'Assets built' in runner.invoke(args=['assets', 'build']).output
+
+    urls = stylesheets(client)
+    assert all(re.search(r'\.[0-9a-f]{12}\.css$', url) for url in urls)
+    response = client.get(urls[1], headers={ 'Accept-Encoding': 'gzip' })
+    assert response.status_code == 200 and response.content_encoding == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control'] and 'Accept-Encoding' in response.vary
+    with open(os.path.join(app.root_path, 'static', 'css', 'style.css'), 'rb') as file:
+        assert gzip.decompress(response.data) == file.read()
+    response.close()
+
+
+def test_manifest_is_reloaded_after_a_build(app, client):
+    stylesheets(client)
+    # as if `flask assets build` ran in another process
+    build(os.path.join(app.root_path, 'static'), app.config['ASSETS_DIR'])
+    assert all(re.search(r'\.[0-9a-f]{12}\.css$', url) for url in stylesheets(client))
+    assert assets.built
@@ -0,0 +1,71 @@
+import pytest
+import sqlalchemy as sa
+
+from app import db, cards
+from app.models import Post, User, Category, Tag
+from app.templatecache import template_cache
+
+HX = { 'HX-Request': 'true' }
+
+pytestmark = pytest.mark.settings(PAGE_CACHE='', RESUME_LENGTH=5)
+
+
+def card(post_id : int):
+    return db.session.execute(sa.select(*cards.CARD_COLUMNS, Post.excerpt).where(Post.id == post_id)).one()
+
+
+def test_summarize():
+    summary = cards.summarize('<p>one <b>two</b> three</p><p>' + 'word ' * 450 + '</p>', 5, 200)
+    assert summary['resume'] == '<p>one <b>two</b> three</p>'
+    assert summary['excerpt'] == 'one two three word word…'
+    assert summary['word_count'] == 453 and summary['reading_time'] == 3
+
+    # no short first paragraph: the excerpt stands in
+    assert cards.summarize('a b c d e f g', 5, 200)['resume'] == '<p>a b c d e…</p>'
+
+
+def test_cards_follow_their_sources(app):
+    with app.app_context():
+        post = db.session.get(Post, 1)
+        amy = db.session.scalar(sa.select(User).where(User.username == 'amy'))
+        post.body = '<p>' + 'word ' * 450 + '</p>'
+        post.author = amy
+        post.set_tags(['x', 'tag1'])
+        db.session.commit()
+        row = card(post.id)
+        assert (row.word_count, row.reading_time, row.author_username, row.tag_names) == (450, 3, 'amy', ['tag1', 'x'])
+
+        db.session.scalar(sa.select(Tag).where(Tag.tag == 'x')).tag = 'zz'
+        amy.fullname = 'Amy Renamed'
+        db.session.get(Category, post.category_id).category = 'newcat'
+        db.session.commit()
+        row = card(post.id)
+        assert (row.author_name, row.category_name, row.tag_names) == ('Amy Renamed', 'newcat', ['tag1', 'zz'])
+
+
+def test_rebuild_matches_the_events(app, runner):
+    with app.app_context():
+        before = db.session.execute(sa.select(*cards.CARD_COLUMNS).order_by(Post.id)).all()
+        db.session.execute(sa.update(Post).values(author_name=None, category_name=None, tag_names=[], word_count=0))
+        db.session.commit()
+    assert 'Rebuilt 12 cards' in runner.invoke(args=['cards', 'rebuild']).output
+    with app.app_context():
+        assert db.session.execute(sa.select(*cards.CARD_COLUMNS).order_by(Post.id)).all() == before
+
+
+def test_fragments_are_reused_and_follow_renames(app, client):
+    first = client.get('/').get_data(as_text=True)
+    entries = len(template_cache._entries)
+    assert entries and client.get('/').get_data(as_text=True) == first
+    assert len(template_cache._entries) == entries
+
+    with app.app_context():
+        db.session.scalar(sa.select(User).where(User.username == 'bob')).fullname = 'Someone Else'
+        db.session.commit()
+    assert 'Someone Else' in client.get('/').get_data(as_text=True)
+
+
+def test_rendered_cards(client):
+    html = client.get('/tag/tag1', headers=HX).get_data(as_text=True)
+    assert 'min read' in html and 'href="/category/cat1"' in html
+    assert '<p>hello 1 world</p>' in html
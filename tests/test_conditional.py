@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import Post, Widget
+
+HX = { 'HX-Request': 'true' }
+
+
+@pytest.mark.settings(PAGE_CACHE='')
+@pytest.mark.parametrize('url', ['/', '/post/post-3', '/tag/tag1', '/category/cat1', '/user/bob'])
+@pytest.mark.parametrize('headers', [{}, HX])
+def test_validators_answer_304_without_loading_bodies(client, queries, url, headers):
+    response = client.get(url, headers=headers)
+    assert response.headers['ETag'] and response.last_modified
+
+    queries.clear()
+    cached = client.get(url, headers={**headers, 'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304 and cached.data == b''
+    assert not any('post.body' in statement for statement in queries.statements)
+
+    since = client.get(url, headers={**headers, 'If-Modified-Since': response.headers['Last-Modified']})
+    assert since.status_code == 304
+
+
+@pytest.mark.settings(PAGE_CACHE='')
+def test_edits_change_the_etag(app, client):
+    etag = client.get('/post/post-3').headers['ETag']
+    with app.app_context():
+        post = db.session.scalar(sa.select(Post).where(Post.slug == 'post-3'))
+        post.last_modified = datetime(2030, 1, 1)
+        db.session.commit()
+    assert client.get('/post/post-3', headers={'If-None-Match': etag}).status_code == 200
+
+
+@pytest.mark.settings(PAGE_CACHE='')
+def test_widgets_only_change_full_pages(app, client):
+    partial = client.get('/tag/tag0', headers=HX).headers['ETag']
+    full = client.get('/tag/tag0').headers['ETag']
+    with app.app_context():
+        db.session.scalar(sa.select(Widget).where(Widget.name == 'about')).additional_data = 'zz'
+        db.session.commit()
+    assert client.get('/tag/tag0', headers={**HX, 'If-None-Match': partial}).status_code == 304
+    assert client.get('/tag/tag0', headers={'If-None-Match': full}).status_code == 200
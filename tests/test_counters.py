@@ -0,0 +1,90 @@
+import sqlalchemy as sa
+
+from app import db
+from app.models import Post, Tag, Comment, post_tags
+
+
+def assert_counts():
+    tags = db.session.execute(sa.select(
+        Tag.tag, Tag.post_count,
+        sa.select(sa.func.count()).where(post_tags.c.tag_id == Tag.id).scalar_subquery())).all()
+    assert all(stored == counted for _, stored, counted in tags), tags
+    posts = db.session.execute(sa.select(
+        Post.slug, Post.comment_count,
+        sa.select(sa.func.count()).where(Comment.post_id == Post.id, Comment.approved == True,
+                                         Comment.blocked == False).scalar_subquery())).all()
+    assert all(stored == counted for _, stored, counted in posts), posts
+
+def tag(name : str) -> Tag:
+    return db.session.scalar(sa.select(Tag).where(Tag.tag == name))
+
+def post(slug : str) -> Post:
+    return db.session.scalar(sa.select(Post).where(Post.slug == slug))
+
+
+def test_counts_follow_tags_and_comments(app):
+    with app.app_context():
+        assert_counts()
+        target = post('post-5')
+        target.add_tags(tag('tag0'))
+        target.remove_tags(tag('tag1'))
+        comment = Comment(post=target, user_id=1, body='x', approved=True)
+        db.session.add(comment)
+        db.session.commit()
+        assert_counts()
+
+        db.session.delete(comment)
+        db.session.commit()
+        assert_counts()
+
+
+def test_set_tags_replaces_and_merges(app):
+    with app.app_context():
+        target = post('post-3')
+        target.set_tags(['new{}'.format(i) for i in range(10)] + ['tag3'])
+        db.session.commit()
+        assert sorted(t.tag for t in target.taglist) == sorted(['new{}'.format(i) for i in range(10)] + ['tag3'])
+        assert target.tag_names == sorted(t.tag for t in target.taglist)
+        assert_counts()
+
+        target.merge_tags(['tag0'])
+        db.session.commit()
+        assert 'tag0' in target.tag_names and 'new0' in target.tag_names
+        assert_counts()
+
+
+def test_pending_comments_are_not_counted_until_approved(app):
+    with app.app_context():
+        target = post('post-3')
+        before = target.comment_count
+        db.session.add_all([Comment(post=target, user_id=2, body='c{}'.format(i)) for i in range(5)])
+        db.session.commit()
+        assert target.comment_count == before
+
+        ids = db.session.scalars(sa.select(Comment.id).where(Comment.pending())).all()
+        assert Comment.moderate(ids[:3], True, 'mod') == 3
+        assert Comment.moderate(ids[3:], False, 'mod') == 2
+        db.session.commit()
+        assert target.comment_count == before + 3
+        assert_counts()
+
+
+def test_counters_rebuild(app, runner):
+    with app.app_context():
+        db.session.execute(sa.update(Tag).values(post_count=99))
+        db.session.execute(sa.update(Post).values(comment_count=99))
+        db.session.commit()
+    assert 'rebuilt' in runner.invoke(args=['counters', 'rebuild']).output
+    with app.app_context():
+        assert_counts()
+
+
+def test_moderation_commands(app, runner):
+    with app.app_context():
+        target = post('post-1')
+        db.session.add_all([Comment(post=target, user_id=2, body='c{}'.format(i)) for i in range(4)])
+        db.session.commit()
+    assert '4 comments approved' in runner.invoke(args=['comments', 'approve', '--all', '--by', 'mod']).output
+    with app.app_context():
+        assert post('post-1').comment_count == 5
+        assert_counts()
@@ -0,0 +1,75 @@
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from app import db, database
+from app.models import Post
+
+HX = { 'HX-Request': 'true' }
+
+pytestmark = pytest.mark.settings(PAGE_CACHE='')
+
+
+def test_pragmas_are_applied(app):
+    with app.app_context():
+        in_effect = database.in_effect(db.engine)
+    assert in_effect['journal_mode'] == 'wal' and in_effect['synchronous'] == '1'
+    assert in_effect['busy_timeout'] == '5000'
+
+
+@pytest.mark.settings(SQLALCHEMY_DATABASE_URI='sqlite://', PAGE_CACHE='')
+def test_memory_databases_keep_one_connection(app):
+    with app.app_context():
+        assert type(db.engine.pool).__name__ == 'StaticPool'
+    assert app.config['READ_BINDS'] == []
+
+
+@pytest.fixture
+def binds(app):
+    """Statements per bind key, None for the primary."""
+    seen = {}
+    with app.app_context():
+        for key, engine in db.engines.items():
+            event.listen(engine, 'before_cursor_execute',
+                         lambda *args, key=key: seen.setdefault(key, []).append(args[2]))
+    return seen
+
+
+def test_read_only_bind_is_pooled_like_the_primary(app):
+    assert app.config['READ_BINDS'] == ['read0']
+    bind = app.config['SQLALCHEMY_BINDS']['read0']
+    assert 'mode=ro' in bind['url'] and bind['pool_size'] == app.config['DB_POOL_SIZE']
+
+
+def test_gets_read_from_the_replica(client, binds, login):
+    for url in ('/', '/post/post-3', '/tag/tag1'):
+        binds.clear()
+        assert client.get(url, headers=HX).status_code == 200
+        assert set(binds) == { 'read0' }, url
+
+    login(1)
+    binds.clear()
+    client.post('/post/post-3/comment', data={ 'body': 'x' }, headers=HX)
+    assert set(binds) == { None }
+
+
+def test_writes_and_dirty_sessions_use_the_primary(app, binds):
+    with app.test_request_context('/'):
+        db.session.get(Post, 1).title = 'changed'
+        binds.clear()
+        db.session.scalar(sa.select(Post.title).where(Post.id == 2))
+        assert set(binds) == { None }
+        db.session.commit()
+
+        binds.clear()
+        db.session.execute(sa.text('UPDATE post SET title = title WHERE id = 2'))
+        assert set(binds) == { None }
+        db.session.rollback()
+
+
+def test_is_select():
+    assert database._is_select(sa.select(Post.id))
+    assert database._is_select(sa.text('  select 1'))
+    assert not database._is_select(sa.text('UPDATE post SET title = 1'))
+    assert not database._is_select(sa.update(Post).values(title='x'))
+    assert not database._is_select(None)
@@ -0,0 +1,52 @@
+import os
+import glob
+
+import pytest
+
+from app import db
+from app.models import Post, Comment
+
+pytestmark = pytest.mark.settings(PAGE_CACHE='')
+
+
+def build(runner, outdir, *args) -> str:
+    return runner.invoke(args=['site', 'build', str(outdir), *args]).output.strip()
+
+
+def test_rebuilds_only_what_changed(app, runner, tmp_path):
+    site = tmp_path / 'site'
+    first = build(runner, site, '-j', '2')
+    assert '0 unchanged, 0 removed, 0 failed' in first
+    assert (site / 'index.html').exists() and (site / 'index.hx.html').exists()
+    assert build(runner, site).startswith('Site built! 0 rendered')
+
+    with app.app_context():
+        db.session.get(Post, 1).title = 'Changed title'
+        db.session.commit()
+    assert not build(runner, site, '-j', '1').startswith('Site built! 0 rendered')
+    html = (site / 'post' / 'post-0' / 'index.html').read_text()
+    assert 'Changed title' in html and '<head>' in html
+    assert '<head>' not in (site / 'index.hx.html').read_text()
+
+
+def test_exported_fragments_match_the_live_site(app, runner, client, tmp_path):
+    site = tmp_path / 'site'
+    build(runner, site)
+    pages = sorted(glob.glob(str(site / 'index' / 'index.before=*.hx.html')))
+    assert pages
+    for path in pages:
+        query = os.path.basename(path)[len('index.'):-len('.hx.html')]
+        live = client.get('/index?' + query, headers={ 'HX-Request': 'true' }).get_data(as_text=True)
+        with open(path) as file:
+            assert file.read() == live
+
+
+def test_comment_pages_follow_new_comments(app, runner, tmp_path):
+    site = tmp_path / 'site'
+    build(runner, site)
+    with app.app_context():
+        db.session.add_all([Comment(post_id=3, user_id=1, body='new {}'.format(i), approved=True)
+                            for i in range(12)])
+        db.session.commit()
+    build(runner, site)
+    assert len(os.listdir(site / 'post' / 'post-2' / 'comments')) > 1
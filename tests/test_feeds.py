@@ -0,0 +1,69 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import Post
+
+ATOM = { 'atom': 'http://www.w3.org/2005/Atom' }
+SITEMAP = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+pytestmark = pytest.mark.settings(PAGE_CACHE='')
+
+
+def test_feed_is_atom_without_bodies(client, queries):
+    response = client.get('/feed.xml')
+    assert response.status_code == 200
+    root = ET.fromstring(response.data)
+    entries = root.findall('atom:entry', ATOM)
+    assert len(entries) == 12
+    assert entries[0].find('atom:title', ATOM).text == 'Post 11'
+    assert not any('post.body' in statement for statement in queries.statements)
+
+
+def test_feed_is_cached_until_posts_change(app, client, queries):
+    first = client.get('/feed.xml')
+    queries.clear()
+    assert client.get('/feed.xml').data == first.data and len(queries) == 0
+    assert client.get('/feed.xml', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    with app.app_context():
+        db.session.scalar(sa.select(Post).where(Post.slug == 'post-11')).title = 'Brand & new'
+        db.session.commit()
+    assert b'Brand &amp; new' in client.get('/feed.xml').data
+
+
+@pytest.mark.parametrize('url, entries', [
+    ('/tag/tag1/feed.xml', 6), ('/category/cat1/feed.xml', 4), ('/user/bob/feed.xml', 6),
+])
+def test_filtered_feeds(client, url, entries):
+    response = client.get(url)
+    assert response.status_code == 200 and response.data.count(b'<entry>') == entries
+
+def test_unknown_feed(client):
+    assert client.get('/tag/nope/feed.xml').status_code == 404
+
+
+def test_small_sitemap_is_one_file(client):
+    response = client.get('/sitemap.xml')
+    root = ET.fromstring(response.data)
+    assert root.tag == SITEMAP + 'urlset'
+    assert b'/post/post-11' in response.data
+
+
+def test_large_sitemap_is_split(app, client):
+    app.config['SITEMAP_MAX_URLS'] = 5
+    index = ET.fromstring(client.get('/sitemap.xml').data)
+    assert index.tag == SITEMAP + 'sitemapindex'
+
+    posts = 0
+    for loc in index.iter(SITEMAP + 'loc'):
+        response = client.get(loc.text.replace('http://localhost', ''))
+        assert response.status_code == 200
+        urls = ET.fromstring(response.data).findall(SITEMAP + 'url')
+        assert 0 < len(urls) <= 5 or 'pages' in loc.text
+        if 'posts' in loc.text:
+            posts += len(urls)
+    assert posts == 12
+    assert client.get('/sitemap-posts-9.xml').status_code == 404
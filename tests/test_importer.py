@@ -0,0 +1,65 @@
+import os
+
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import Post, Tag, post_tags
+
+POST = 'title: Hello {0}\nauthor: bob\ncategory: news\ntags: a\n    b{1}\n\nSome *text* {0}\n\nMore\n'
+
+
+@pytest.fixture
+def sources(tmp_path):
+    directory = tmp_path / 'posts'
+    directory.mkdir()
+    for i in range(5):
+        (directory / 'Hello World {}.md'.format(i)).write_text(POST.format(i, i % 2))
+    (directory / 'broken.md').write_text('title: x\n\nno author')
+    return sorted(str(path) for path in directory.iterdir())
+
+
+def summary(runner, command, *args) -> str:
+    result = runner.invoke(args=['file', command, *args])
+    return result.output.strip().splitlines()[-1]
+
+
+def test_upload_skips_unchanged_files(runner, sources):
+    assert summary(runner, 'upload', *sources).endswith('5 created, 0 updated, 0 skipped, 1 failed')
+    assert summary(runner, 'upload', *sources).endswith('0 created, 0 updated, 5 skipped, 1 failed')
+
+    # a newer mtime alone is checked against the content hash
+    os.utime(sources[0])
+    assert summary(runner, 'upload', *sources).endswith('0 created, 0 updated, 5 skipped, 1 failed')
+
+    with open(sources[1], 'a') as file:
+        file.write('extra\n')
+    assert summary(runner, 'upload', *sources).endswith('0 created, 1 updated, 4 skipped, 1 failed')
+    assert summary(runner, 'upload', '--force', *sources).endswith('0 created, 5 updated, 0 skipped, 1 failed')
+
+
+def test_upload_updates_the_post(app, runner, sources):
+    summary(runner, 'upload', *sources)
+    with open(sources[1], 'a') as file:
+        file.write('\nA new paragraph\n')
+    summary(runner, 'upload', *sources)
+    with app.app_context():
+        post = db.session.scalar(sa.select(Post).where(Post.slug == 'hello-world-1'))
+        assert 'A new paragraph' in post.body
+        assert post.content_hash and post.source_mtime
+        assert post.tag_names == ['a', 'b1']
+
+
+@pytest.mark.parametrize('jobs', ['1', '3'])
+def test_bulk_import_matches_upload(app, runner, sources, jobs):
+    assert summary(runner, 'import', '-j', jobs, '-b', '2', *sources).endswith(
+        '5 created, 0 updated, 0 skipped, 1 failed')
+    assert summary(runner, 'import', '-j', jobs, *sources).endswith(
+        '0 created, 0 updated, 5 skipped, 1 failed')
+    with app.app_context():
+        assert db.session.scalar(sa.select(sa.func.count()).select_from(Post).where(Post.slug.like('hello-world-%'))) == 5
+        tags = db.session.execute(sa.select(
+            Tag.tag, Tag.post_count,
+            sa.select(sa.func.count()).where(post_tags.c.tag_id == Tag.id).scalar_subquery())).all()
+        assert all(stored == counted for _, stored, counted in tags)
+        assert db.session.scalar(sa.select(Tag.post_count).where(Tag.tag == 'a')) == 5
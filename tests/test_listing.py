@@ -0,0 +1,64 @@
+import re
+from html import unescape
+
+import pytest
+
+HX = { 'HX-Request': 'true' }
+LISTINGS = ['/', '/tag/tag1', '/category/cat1', '/user/bob']
+
+
+def titles(response) -> list[int]:
+    return [int(number) for number in re.findall(rb'<h1>Post (\d+)</h1>', response.data)]
+
+def pager(response) -> tuple:
+    """(newer, older) page urls, None when the button is disabled."""
+    buttons = re.findall(rb'hx-get="([^"]*)" hx-target="#posts"\s+hx-swap="innerHTML"( disabled)?',
+                         response.data)
+    return tuple(None if disabled else unescape(url.decode()) for url, disabled in buttons)
+
+
+@pytest.mark.settings(PAGE_CACHE='')
+@pytest.mark.parametrize('url', LISTINGS)
+def test_listing_queries_do_not_grow_with_the_page(app, client, queries, url):
+    counts = []
+    for per_page in (2, 10):
+        app.config['PER_PAGE'] = per_page
+        client.get(url, headers=HX)
+        queries.clear()
+        assert client.get(url, headers=HX).status_code == 200
+        counts.append(len(queries))
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.settings(PAGE_CACHE='')
+@pytest.mark.parametrize('url, expected', [('/', 12), ('/category/cat1', 4), ('/user/bob', 6), ('/tag/tag1', 6)])
+def test_cursors_walk_every_post_once(client, url, expected):
+    seen, pages = [], []
+    while url:
+        response = client.get(url, headers=HX)
+        assert response.status_code == 200
+        pages.append((url, titles(response)))
+        seen += titles(response)
+        url = pager(response)[1]
+    assert seen == sorted(seen, reverse=True)
+    assert len(set(seen)) == len(seen) == expected
+
+    # and back again from the last page
+    url, back = pager(client.get(pages[-1][0], headers=HX))[0], []
+    while url:
+        response = client.get(url, headers=HX)
+        back.insert(0, titles(response))
+        url = pager(response)[0]
+    assert back == [page for _, page in pages[:-1]]
+
+
+@pytest.mark.settings(PAGE_CACHE='')
+def test_page_numbers_still_work(client):
+    assert titles(client.get('/?page=2', headers=HX)) == [6, 5, 4, 3, 2]
+
+
+@pytest.mark.settings(PAGE_CACHE='')
+def test_bad_cursor_is_the_first_page(client):
+    response = client.get('/?before=garbage!', headers=HX)
+    assert response.status_code == 200
+    assert titles(response) == [11, 10, 9, 8, 7]
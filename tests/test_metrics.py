@@ -0,0 +1,71 @@
+import json
+import logging
+
+import pytest
+import sqlalchemy as sa
+
+from app import db
+
+AUTH = { 'Authorization': 'Bearer s3cret' }
+
+
+def sample(client, series : str) -> float:
+    """The value of `series` on /metrics; counters live as long as the worker."""
+    for line in client.get('/metrics', headers=AUTH).get_data(as_text=True).splitlines():
+        if line.startswith(series + ' '):
+            return float(line.split()[-1])
+    return 0.0
+
+
+@pytest.mark.settings(PAGE_CACHE='', INSTRUMENTATION=True, REPEATED_QUERY_THRESHOLD=3)
+def test_server_timing_and_repeated_queries(app, client, caplog):
+    @app.route('/repeat')
+    def repeat():
+        for i in range(4):
+            db.session.execute(sa.text('SELECT * FROM tag WHERE tag = :tag'), { 'tag': str(i) }).all()
+        return 'done'
+
+    response = client.get('/post/post-3')
+    response.close()
+    assert all(part in response.headers['Server-Timing'] for part in ('db;', 'render;', 'total;'))
+
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        client.get('/repeat').close()
+    assert any('Repeated query (4 times)' in message for message in caplog.messages)
+
+
+@pytest.mark.settings(METRICS=True, METRICS_WRITE_INTERVAL=0, METRICS_TOKEN='s3cret')
+def test_metrics_add_up_workers(app, client):
+    requests = 'cms_request_duration_seconds_count{endpoint="main.index",mode="full"}'
+    hits = 'cms_cache_requests_total{cache="page",result="hit"}'
+    before = sample(client, requests), sample(client, hits)
+    for url in ('/', '/', '/post/post-3'):
+        client.get(url).close()
+    assert sample(client, requests) == before[0] + 2
+    assert sample(client, hits) == before[1] + 1
+
+    # a worker that has gone away: its counters stay, its gauges do not
+    timeouts = sample(client, 'cms_db_pool_timeouts_total')
+    with open('{}/999999.json'.format(app.config['METRICS_DIR']), 'w') as file:
+        json.dump({ 'values': [['cms_db_pool_timeouts_total', [], 3]],
+                    'gauges': [['cms_activity_pending', [], 99]] }, file)
+    assert sample(client, 'cms_db_pool_timeouts_total') == timeouts + 3
+    assert sample(client, 'cms_activity_pending') != 99
+
+
+@pytest.mark.settings(METRICS=True, METRICS_TOKEN=None)
+def test_loopback_only_needs_a_token(client):
+    assert client.get('/metrics').status_code == 403
+
+
+@pytest.mark.settings(METRICS=True, METRICS_TOKEN='s3cret')
+def test_token_and_networks(client):
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers=AUTH).status_code == 200
+    assert client.get('/metrics', headers=AUTH, environ_base={ 'REMOTE_ADDR': '10.0.0.1' }).status_code == 403
+
+
+@pytest.mark.settings(METRICS=True, METRICS_TOKEN=None, METRICS_ALLOW='10.0.0.0/8')
+def test_private_networks_without_a_token(client):
+    assert client.get('/metrics', environ_base={ 'REMOTE_ADDR': '10.0.0.1' }).status_code == 200
+    assert client.get('/metrics', environ_base={ 'REMOTE_ADDR': '192.0.2.1' }).status_code == 403
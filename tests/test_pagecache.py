@@ -0,0 +1,107 @@
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import Post, Tag, Category, Comment, Widget, User
+
+HX = { 'HX-Request': 'true' }
+
+
+def cache_state(client, url, headers=HX) -> str:
+    return client.get(url, headers=headers).headers['X-Cache']
+
+def warm(client, *urls):
+    for url in urls:
+        client.get(url, headers=HX)
+
+
+@pytest.mark.parametrize('backend', [
+    pytest.param('memory', marks=pytest.mark.settings(PAGE_CACHE='memory')),
+    pytest.param('file', marks=pytest.mark.settings(PAGE_CACHE='file')),
+])
+def test_hits_run_no_queries(app, client, queries, backend):
+    for url in ('/', '/post/post-3', '/tag/tag1', '/category/cat1', '/user/bob'):
+        for headers in ({}, HX):
+            first = client.get(url, headers=headers)
+            assert first.headers['X-Cache'] == 'MISS'
+            queries.clear()
+            second = client.get(url, headers=headers)
+            assert second.headers['X-Cache'] == 'HIT' and second.data == first.data
+            assert len(queries) == 0
+    assert client.get('/', headers=HX).data != client.get('/').data
+
+
+def test_post_edit_invalidates_only_its_pages(app, client):
+    # post-3: cat0, tag3 and tag0, by bob
+    warm(client, '/post/post-3', '/', '/user/bob', '/category/cat0', '/tag/tag3', '/tag/tag1', '/category/cat1')
+    with app.app_context():
+        db.session.scalar(sa.select(Post).where(Post.slug == 'post-3')).title = 'Changed'
+        db.session.commit()
+    for url in ('/post/post-3', '/', '/user/bob', '/category/cat0', '/tag/tag3'):
+        assert cache_state(client, url) == 'MISS', url
+    for url in ('/tag/tag1', '/category/cat1'):
+        assert cache_state(client, url) == 'HIT', url
+    assert b'Changed' in client.get('/category/cat0', headers=HX).data
+
+
+def test_tagging_invalidates_the_tag_page(app, client):
+    warm(client, '/tag/tag1', '/category/cat1')
+    with app.app_context():
+        post = db.session.scalar(sa.select(Post).where(Post.slug == 'post-6'))
+        post.add_tags(db.session.scalar(sa.select(Tag).where(Tag.tag == 'tag1')))
+        db.session.commit()
+    assert cache_state(client, '/tag/tag1') == 'MISS'
+    assert cache_state(client, '/category/cat1') == 'HIT'
+
+
+def test_moderation_invalidates_the_post(app, client):
+    with app.app_context():
+        comment = Comment(post_id=2, user_id=1, body='pending')
+        db.session.add(comment)
+        db.session.commit()
+        comment_id = comment.id
+    warm(client, '/post/post-1', '/category/cat1')
+    with app.app_context():
+        Comment.moderate([comment_id], True, 'mod')
+        db.session.commit()
+    assert cache_state(client, '/post/post-1') == 'MISS'
+    assert cache_state(client, '/category/cat1') == 'MISS'
+
+
+def test_renames_invalidate_every_card(app, client):
+    warm(client, '/tag/tag1', '/user/amy')
+    with app.app_context():
+        db.session.scalar(sa.select(Category).where(Category.category == 'cat1')).category = 'renamed'
+        db.session.commit()
+    response = client.get('/tag/tag1', headers=HX)
+    assert response.headers['X-Cache'] == 'MISS' and b'renamed' in response.data
+
+    warm(client, '/tag/tag1')
+    with app.app_context():
+        db.session.scalar(sa.select(User).where(User.username == 'bob')).fullname = 'Robert'
+        db.session.commit()
+    assert cache_state(client, '/tag/tag1') == 'MISS'
+
+
+def test_widgets_invalidate_full_pages_only(app, client):
+    client.get('/')
+    warm(client, '/')
+    with app.app_context():
+        db.session.scalar(sa.select(Widget).where(Widget.name == 'about')).additional_data = 'New about'
+        db.session.commit()
+    assert cache_state(client, '/') == 'HIT'
+    response = client.get('/')
+    assert response.headers['X-Cache'] == 'MISS' and b'New about' in response.data
+
+
+def test_clear_and_logged_in_users(app, client, runner, login):
+    warm(client, '/')
+    runner.invoke(args=['cache', 'clear'])
+    assert cache_state(client, '/') == 'MISS'
+    login(1)
+    assert 'X-Cache' not in client.get('/').headers
+
+
+def test_unknown_args_share_the_entry(client):
+    warm(client, '/')
+    assert cache_state(client, '/?utm_source=x') == 'HIT'
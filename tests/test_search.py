@@ -0,0 +1,59 @@
+import pytest
+import sqlalchemy as sa
+
+from app import db, search
+from app.models import Post
+
+HX = { 'HX-Request': 'true' }
+
+pytestmark = pytest.mark.settings(PAGE_CACHE='')
+
+
+@pytest.fixture
+def indexed(runner):
+    assert 'Indexed 12 posts' in runner.invoke(args=['search', 'rebuild']).output
+
+
+def test_title_fallback_without_the_index(app, client):
+    with app.app_context():
+        db.session.execute(sa.text('DROP TABLE IF EXISTS post_fts'))
+        db.session.commit()
+    response = client.get('/search?q=Post 1', headers=HX)
+    assert response.status_code == 200 and b'Post 1' in response.data
+
+
+def test_matches_are_highlighted_and_escaped(app, client, indexed):
+    response = client.get('/search?q=hello', headers=HX)
+    assert b'<mark>hello</mark>' in response.data
+
+    with app.app_context():
+        db.session.get(Post, 3).body = '<p>Zebra &lt;script&gt;alert(1)&lt;/script&gt; crossing</p>'
+        db.session.commit()
+    assert b'<mark>Zebra</mark> &lt;script&gt;' in client.get('/search?q=zebra', headers=HX).data
+
+
+def test_index_follows_writes(app, client, indexed):
+    with app.app_context():
+        db.session.get(Post, 4).title = 'Unicorn parade'
+        db.session.add(Post(slug='giraffe', title='Giraffe', body='<p>tall animals</p>', user_id=1, category_id=1))
+        db.session.commit()
+    assert b'Unicorn' in client.get('/search?q=unicor', headers=HX).data
+    assert b'Giraffe' in client.get('/search?q=animal', headers=HX).data
+
+
+def test_odd_queries(client, indexed):
+    assert client.get('/search?q="AND OR (').status_code == 200
+    assert b'No posts found' in client.get('/search?q=qqqqq').data
+
+
+def test_rebuild_is_seen_by_other_workers(app, runner):
+    with app.app_context():
+        db.session.execute(sa.text('DROP TABLE IF EXISTS post_fts'))
+        db.session.commit()
+        assert not search.is_available(db.session.connection())
+        db.session.rollback()
+    runner.invoke(args=['search', 'rebuild'])
+    with app.app_context():
+        # what another worker still remembers
+        search._available[db.engine] = (0, False)
+        assert search.is_available(db.session.connection())
@@ -0,0 +1,48 @@
+import gzip
+
+import pytest
+
+from app import db
+from app.models import Post
+
+pytestmark = pytest.mark.settings(PAGE_CACHE='', STREAM_CHUNK_SIZE=2048)
+
+
+@pytest.fixture
+def long_post(app):
+    with app.app_context():
+        db.session.get(Post, 4).body = '<p>' + 'long text ' * 50000 + '</p>'
+        db.session.commit()
+
+
+def test_pages_stream_gzip(client, long_post):
+    plain = client.get('/', headers={ 'Accept-Encoding': 'identity' })
+    assert plain.is_streamed and plain.content_encoding is None
+
+    packed = client.get('/', headers={ 'Accept-Encoding': 'gzip' })
+    assert packed.content_encoding == 'gzip' and 'Accept-Encoding' in packed.vary
+    assert gzip.decompress(packed.data) == plain.data
+    assert client.get('/', headers={ 'Accept-Encoding': 'gzip',
+                                     'If-None-Match': packed.headers['ETag'] }).status_code == 304
+
+
+def test_body_is_sent_in_chunks(client, long_post):
+    response = client.get('/post/post-3', headers={ 'Accept-Encoding': 'gzip' }, buffered=False)
+    chunks = list(response.response)
+    assert len(chunks) > 1
+    assert b'long text' in gzip.decompress(b''.join(chunks))
+
+
+def test_htmx_and_small_pages_are_not_streamed(app, client):
+    assert client.get('/', headers={ 'Accept-Encoding': 'gzip', 'HX-Request': 'true' }).content_encoding is None
+    app.config['STREAM_MIN_SIZE'] = 10 ** 6
+    response = client.get('/', headers={ 'Accept-Encoding': 'gzip' })
+    assert response.content_encoding is None and response.content_length
+
+
+@pytest.mark.settings(PAGE_CACHE='memory')
+def test_cached_pages_are_stored_whole(client):
+    first = client.get('/', headers={ 'Accept-Encoding': 'gzip' })
+    assert first.headers['X-Cache'] == 'MISS' and first.content_encoding is None
+    response = client.get('/', headers={ 'Accept-Encoding': 'gzip' })
+    assert response.headers['X-Cache'] == 'HIT' and response.data == first.data
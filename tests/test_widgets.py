@@ -0,0 +1,75 @@
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import User, Widget, Category, Comment
+from app.identity import identities
+
+HX = { 'HX-Request': 'true' }
+
+pytestmark = pytest.mark.settings(PAGE_CACHE='')
+
+
+def test_widgets_are_inlined_from_the_cache(client, queries):
+    response = client.get('/')
+    assert b'hx-get="/widgets/' not in response.data
+    assert b'About' in response.data and b'cat2' in response.data
+
+    # the sidebar costs nothing once cached
+    queries.clear()
+    client.get('/')
+    with_sidebar = len(queries)
+    queries.clear()
+    client.get('/', headers=HX)
+    assert with_sidebar == len(queries)
+
+
+def test_widget_changes_show_up(app, client):
+    client.get('/')
+    with app.app_context():
+        db.session.add(Category(category='newcat'))
+        db.session.scalar(sa.select(Widget).where(Widget.name == 'tags')).lazy = True
+        db.session.commit()
+    response = client.get('/')
+    assert b'newcat' in response.data and b'hx-get="/widgets/tags"' in response.data
+
+    with app.app_context():
+        db.session.scalar(sa.select(Widget).where(Widget.name == 'categories')).is_active = False
+        db.session.commit()
+    assert b'newcat' not in client.get('/').data
+
+
+def test_widget_endpoints_are_htmx_only(client):
+    assert b'tag1' in client.get('/widgets/tags', headers=HX).data
+    assert client.get('/widgets/tags').status_code == 302
+
+
+def test_logged_in_requests_do_not_load_the_user(app, client, queries, login):
+    login(1)
+    client.get('/widgets/about', headers=HX)
+    queries.clear()
+    client.get('/widgets/about', headers=HX)
+    assert not any('FROM user' in statement for statement in queries.statements)
+
+    with app.app_context():
+        db.session.get(User, 1).fullname = 'Bobby'
+        db.session.commit()
+    with app.test_request_context():
+        assert identities.load('1').fullname == 'Bobby'
+        assert identities.load('999') is None and identities.load('abc') is None
+
+
+def test_identity_is_read_only(app):
+    with app.test_request_context():
+        identity = identities.load('1')
+        assert identity.username == 'bob' and identity.is_authenticated and identity.get_id() == '1'
+        with pytest.raises(Exception):
+            identity.username = 'x'
+
+
+def test_posting_a_comment(app, client, login):
+    login(1)
+    response = client.post('/post/post-3/comment', data={ 'body': 'hi' }, headers=HX)
+    assert response.status_code == 200 and b'moderator' in response.data
+    with app.app_context():
+        assert db.session.scalar(sa.select(Comment).where(Comment.body == 'hi')).approved is False